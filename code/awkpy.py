@@ -24,7 +24,6 @@ import random
 import math
 from pathlib import Path
 from collections import defaultdict
-from awkpy_compiler import AwkPyCompiler
 from awkpy_runtime import (
     AwkpyRuntimeVarOwner,
     AwkpyRuntimeWrapper,
@@ -33,23 +32,50 @@ from awkpy_runtime import (
     AwkExit,
     AwkEmptyVar,
     AwkEmptyVarInstance,
+    AwkStrNum,
+    AwkBytesNum,
 )
 from awkpy_common import AwkPyArgParser
+from awkpy_cache import AwkPyCodeCache
 
 
 def run(args):
-    compiler = AwkPyCompiler(debug=False)
     compiler_args = []
     runtime_args = []
     arg_parser = AwkPyArgParser(compiler_args, runtime_args, compiler_args)
     arg_parser.parse(args)
-    compiler.do_debug = arg_parser.debug
-    python_source = compiler.compile(compiler_args) + "\nruntime=AwkPyTranslated()\n"
-    if arg_parser.output_file_name:
-        with open(arg_parser.output_file_name, "w") as out_file:
-            out_file.write(python_source)
-            out_file.write(f"runtime._run(sys.argv[1:])\n")
-        os.chmod(arg_parser.output_file_name, 0o755)
+    #
+    # The cache only holds code objects, so is bypassed whenever
+    # the Python source is wanted
+    cache = AwkPyCodeCache()
+    use_cache = (
+        arg_parser.use_cache
+        and cache.enabled()
+        and not arg_parser.output_file_name
+        and not arg_parser.debug
+    )
+    code = python_source = None
+    if use_cache:
+        cache_key = cache.key(compiler_args)
+        code = cache.get(cache_key)
+    if code is None:
+        # imported here so that cache hits skip loading the compiler
+        from awkpy_compiler import AwkPyCompiler
+
+        compiler = AwkPyCompiler(debug=arg_parser.debug)
+        python_source = (
+            compiler.compile(compiler_args) + "\nruntime=AwkPyTranslated()\n"
+        )
+        if arg_parser.output_file_name:
+            with open(arg_parser.output_file_name, "w") as out_file:
+                out_file.write(python_source)
+                out_file.write(f"runtime._run(sys.argv[1:])\n")
+            os.chmod(arg_parser.output_file_name, 0o755)
+        code = compile(python_source, "generated", "exec")
+        if use_cache:
+            cache.put(
+                cache_key, code, compiler.source_files + compiler.included_files
+            )
     #
     # non-standard command-line option -Wr = All following args
     # bypass the compiler & are passed to the execution runtime.
@@ -61,12 +87,13 @@ def run(args):
         arg_parser = AwkPyArgParser(runtime_args, runtime_args, runtime_args)
         arg_parser.parse(wr)
     runtime_args.insert(0, arg_parser.program_name)
-    python_source += f"runtime._run({runtime_args})\n"
-    if arg_parser.debug:
-        print(python_source)
+    run_source = f"runtime._run({runtime_args})\n"
+    if arg_parser.debug and python_source:
+        print(python_source + run_source)
         print("-------------------------------------------")
-    code = compile(python_source, "generated", "exec")
-    exec(code, globals(), locals())
+    generated_locals = {}
+    exec(code, globals(), generated_locals)
+    exec(compile(run_source, "generated", "exec"), globals(), generated_locals)
     return AwkpyRuntimeWrapper._ans
 
 
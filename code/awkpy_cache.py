@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+"""
+    AWK to python translator:
+    On-disk cache of compiled programs used by awkpy.py
+"""
+#
+# Copyright (C) 2022 Julia Ingleby Clement
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import marshal
+import os
+import re
+import sys
+from importlib.util import find_spec
+from pathlib import Path
+from awkpy_common import awkpy_version
+
+
+class AwkPyCodeCache:
+    """Cache of generated Python code objects, one file per program.
+
+    Entries are keyed on the compiler arguments (awk source, -f/-i file
+    names & -v initial values), the files @include names, which are found
+    relative to the current directory, the awkpy version and the Python
+    implementation, as marshalled code is specific to the interpreter.
+    Source files read by the compiler are recorded with the entry and
+    checked on every hit, so editing an -f or @include file invalidates it.
+
+    The least recently used entries are removed once there are more than
+    max_entries of them. Hits touch the entry, so file mtime tracks use.
+    """
+
+    suffix = ".awkpyc"
+    include_regex = re.compile(r'@include\s+"([^"]+)"')
+
+    def __init__(self, directory=None, max_entries=None):
+        if directory is None:
+            directory = os.environ.get("AWKPY_CACHE_DIR", None)
+        if directory is None:
+            xdg = os.environ.get("XDG_CACHE_HOME", None)
+            base = Path(xdg) if xdg else Path.home() / ".cache"
+            directory = base / "awkpy"
+        if max_entries is None:
+            max_entries = int(os.environ.get("AWKPY_CACHE_SIZE", "256"))
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key(self, compiler_args: list) -> str:
+        """Hash everything that can change the generated code"""
+        # the compiler module isn't imported, to keep cache hits cheap
+        compiler_spec = find_spec("awkpy_compiler")
+        compiler_id = ""
+        if compiler_spec is not None and compiler_spec.origin:
+            signature = self._file_signature(compiler_spec.origin)
+            if signature is not None:
+                compiler_id = f"{signature[0]}:{signature[1]}"
+        hasher = hashlib.sha256()
+        for part in [awkpy_version, sys.implementation.cache_tag, compiler_id]:
+            hasher.update(part.encode("utf-8", "surrogateescape") + b"\0")
+        for arg in compiler_args:
+            # -f & -i name files, which may be relative to the current directory
+            if len(arg) > 2 and arg[0:2] in ["-f", "-i"]:
+                arg = arg[0:2] + os.path.abspath(arg[2:])
+            hasher.update(arg.encode("utf-8", "surrogateescape") + b"\0")
+        for name in self._included_files(compiler_args):
+            signature = self._file_signature(name)
+            hasher.update(f"{name}:{signature}".encode("utf-8", "surrogateescape") + b"\0")
+        return hasher.hexdigest()
+
+    def _included_files(self, compiler_args: list) -> list:
+        """The absolute names of the files @include names in the awk
+        source, directly or in other files. Anything that looks like an
+        @include is counted, a few too many only costs some hashing"""
+        texts = []
+        for arg in compiler_args:
+            if len(arg) > 2 and arg[0:2] in ["-f", "-i"]:
+                texts.append(self._read(arg[2:]))
+            else:
+                texts.append(arg)
+        included = []
+        while texts:
+            for name in self.include_regex.findall(texts.pop()):
+                name = os.path.abspath(name)
+                if name not in included:
+                    included.append(name)
+                    texts.append(self._read(name))
+        return included
+
+    @staticmethod
+    def _read(name: str) -> str:
+        try:
+            with open(name, "r", errors="replace") as file:
+                return file.read()
+        except OSError:
+            return ""
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / (key + self.suffix)
+
+    @staticmethod
+    def _file_signature(name: str):
+        try:
+            stat = os.stat(name)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def get(self, key: str):
+        """Return the cached code object or None"""
+        entry = self._entry(key)
+        try:
+            with open(entry, "rb") as cache_file:
+                dependencies, code = marshal.load(cache_file)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        for name, size, mtime in dependencies:
+            if self._file_signature(name) != (size, mtime):
+                return None
+        try:
+            os.utime(entry)  # mark as recently used
+        except OSError:
+            pass
+        return code
+
+    def put(self, key: str, code, source_files: list = None):
+        """Save code, silently giving up if the cache directory is unusable"""
+        dependencies = []
+        for name in source_files or []:
+            signature = self._file_signature(name)
+            if signature is None:
+                return
+            dependencies.append((os.path.abspath(name),) + signature)
+        entry = self._entry(key)
+        temp_entry = entry.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(temp_entry, "wb") as cache_file:
+                marshal.dump((dependencies, code), cache_file)
+            os.replace(temp_entry, entry)
+        except OSError:
+            try:
+                temp_entry.unlink()
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries beyond max_entries"""
+        try:
+            entries = [
+                (entry.stat().st_mtime_ns, entry)
+                for entry in self.directory.glob("*" + self.suffix)
+            ]
+        except OSError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, entry in entries[: len(entries) - self.max_entries]:
+            try:
+                entry.unlink()
+            except OSError:
+                pass
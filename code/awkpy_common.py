@@ -20,6 +20,9 @@
 
 from sys import argv
 
+# Part of the key of cached compiled programs, see awkpy_cache.py
+awkpy_version = "0.2"
+
 
 class AwkPyArgParser:
     """Parses commandline args.
@@ -37,6 +40,7 @@ class AwkPyArgParser:
         self.code_found = False
         self.output_file_name = None
         self.program_name = "generated"
+        self.use_cache = True
 
     def parse(self, args=argv):
         self.program_name = args[0]
@@ -44,11 +48,18 @@ class AwkPyArgParser:
         while i < len(args):
             curr_arg = args[i]
             if curr_arg[0] == "-" and len(curr_arg) > 1:
+                if curr_arg == "--csv":  # CSV input & print, an awkpy::csv option
+                    self.compiler_options.append(curr_arg)
+                    self.variables.append("-vawkpy::csv=1")
+                    i += 1
+                    continue
                 if curr_arg[1] == "-":  # end of arguments, data files follow
                     i += 1
                     self.runtime_options.extend(args[i:])
                     break
-                if curr_arg[1] == "d":  # self.debug
+                if curr_arg == "-b":  # characters as bytes, decided at compile time
+                    self.compiler_options.append(curr_arg)
+                elif curr_arg[1] == "d":  # self.debug
                     self.debug = True
                     print(args)
                 elif curr_arg[1] == "e":  # source text
@@ -89,6 +100,10 @@ class AwkPyArgParser:
                 ):  # all remaining args sent to runtime skipping compiler
                     self.runtime_options.extend(args[i:])
                     break
+                elif curr_arg == "-Wnocache":  # don't use the compiled program cache
+                    self.use_cache = False
+                elif curr_arg == "-Wnohoist":  # keep globals in self, decided at compile time
+                    self.compiler_options.append(curr_arg)
                 elif (curr_arg in "-Wprofile" or curr_arg in "-Wcprofile") and len(
                     curr_arg
                 ) > 2:
@@ -20,6 +20,7 @@
 # limitations under the License.
 
 from curses.ascii import isupper
+import ast
 import re
 from enum import IntEnum
 from collections import defaultdict
@@ -104,6 +105,17 @@ class AwkNamespace:
 
 AwkNamespace.startup()
 
+
+def bytes_escaped(text: str) -> str:
+    """text for a Python bytes literal, non-ASCII characters become
+    \\x escapes of their UTF-8 bytes. Bytes that weren't valid UTF-8
+    on the command line come back as they were."""
+    if text.isascii():
+        return text
+    encoded = text.encode("utf-8", "surrogateescape")
+    return "".join(chr(b) if b < 128 else f"\\x{b:02x}" for b in encoded)
+
+
 """ Symbol Table"""
 
 
@@ -254,8 +266,12 @@ class SymRegex(Sym):
         awk_priority: int = 10000,
         python_priority: int = 10000,
         python_equivalent=None,
+        bytes_mode=False,
     ):
-        init = f're.compile(r"({token[1:-1]})")'
+        if bytes_mode:
+            init = f're.compile(rb"({bytes_escaped(token[1:-1])})")'
+        else:
+            init = f're.compile(r"({token[1:-1]})")'
         SymRegex.seq += 1
         if python_equivalent is None:
             python_equivalent = f"self._re_{SymRegex.seq}"
@@ -270,6 +286,27 @@ class SymRegex(Sym):
         return True
 
 
+class SymField(Sym):
+    """Symbol table entry for $variable, a field chosen at run time"""
+
+    def __init__(self, token: str, variable: Sym):
+        self.variable = variable
+        super().__init__(token, SymType.DOLLAR)
+
+    @property
+    def python_equivalent(self):
+        # looked up each time as function parameters are renamed while
+        # the function is being compiled
+        index = self.variable.python_equivalent
+        if self.variable.token != "NF":
+            index = f"int({index})"
+        return f"self._record[{index}]"
+
+    @python_equivalent.setter
+    def python_equivalent(self, value):
+        pass  # always worked out from the variable
+
+
 class SymVariable(Sym):
     """Symbol table entry for variable, build-in or user defined"""
 
@@ -293,6 +330,11 @@ class SymVariable(Sym):
         self.built_in = built_in
         self.is_array = array
         self.is_scalar = scalar
+        # What the program assigns to the variable (or its elements) and
+        # how it uses them, see AwkPyCompiler.note_variable_types()
+        self.assignments = []
+        self.uses = set()
+        self.is_parameter = False
 
     def is_operator(self):
         return False
@@ -582,6 +624,7 @@ class AwkPyCompiler:
         have_output = False
         if isinstance(source, str):
             source = source.split("\n")
+        prior_sym = sym
         for token in self.lex_lines(source, filename):
             if len(token) > 1:
                 token = token.strip()
@@ -617,7 +660,12 @@ class AwkPyCompiler:
                 elif token.replace("::", "__").isidentifier():
                     sym = SymVariable(token)
                 elif token[0] == '"':
-                    sym = Sym(token.replace(chr(1), '\\"'), SymType.STRING)
+                    token = token.replace(chr(1), '\\"')
+                    sym = Sym(
+                        token,
+                        SymType.STRING,
+                        python_equivalent=self.string_literal(token),
+                    )
                 elif token[0].isspace():
                     # sym=Sym(token,SymType.SPACE)
                     continue
@@ -626,14 +674,23 @@ class AwkPyCompiler:
                 elif len(token) > 1 and token[0] == "-" and token[1] in "1234567890":
                     sym = Sym(token, SymType.NUMBER)
                 elif len(token) > 1 and token[0] == "$":
-                    sym = Sym(
-                        token,
-                        SymType.DOLLAR,
-                        python_equivalent=f"self._FLDS[{token[1:]}]",
-                    )
+                    index = token[1:]
+                    if index.isidentifier():  # $i, $NF
+                        if not index.isupper() and index not in self.reserved_words:
+                            index = tokenns.decorated + index
+                        variable = self.syms.get(index)
+                        if variable is None:
+                            variable = self.syms[index] = SymVariable(index)
+                        sym = SymField(token, variable)
+                    else:
+                        sym = Sym(
+                            token,
+                            SymType.DOLLAR,
+                            python_equivalent=f"self._record[{index}]",
+                        )
                 elif len(token) > 1 and token[0] == "/":
                     # regex, operators already recognised
-                    sym = SymRegex(token)
+                    sym = SymRegex(token, bytes_mode=self.bytes_mode)
                 elif token == ">>":
                     sym = Sym(token, SymType.REDIRECT, python_equivalent=token)
                 elif token[0] == "#":
@@ -648,6 +705,13 @@ class AwkPyCompiler:
                         f"Unrecognised token {token} near line {self.lineNr}"
                     )
                 self.syms[token] = sym
+            if sym.sym_type == SymType.DOLLAR:
+                self.note_field_reference(sym.token)
+            elif sym.token == "NF":
+                self.uses_NF = True
+            self.note_field_assignment(prior_sym, sym)
+            self.note_separator_assignment(prior_sym, sym)
+            prior_sym = sym
             if have_output or sym.token != "\n":
                 answer.append((self.lineNr, sym))
                 have_output = True
@@ -657,9 +721,503 @@ class AwkPyCompiler:
         answer.append(sym)
         answer.append(sym)
         answer.append(sym)
+        self.note_variable_types(answer)
+        self.note_substitution_targets(answer)
         AwkNamespace.set_current_namespace(oldns)
         return answer
 
+    def note_field_reference(self, token: str):
+        """Field projection analysis: record the highest constant $n used
+        and whether fields are chosen at run time ($i, $NF, $(expr))"""
+        index = token[1:]
+        if index.isdigit():
+            self.max_field_used = max(self.max_field_used, int(index))
+        else:
+            self.dynamic_fields = True
+
+    def note_field_assignment(self, prior_sym: Sym, sym: Sym):
+        """Spot $n = ..., NF = ..., ++$n and so on. After these, $0 has
+        to be rebuilt from the fields when it is next used"""
+
+        def is_field(sym):
+            return sym.sym_type == SymType.DOLLAR or sym.token == "NF"
+
+        if is_field(prior_sym) and sym.token in self.assignment_operators:
+            self.assigns_fields = True
+        elif is_field(sym) and prior_sym.token in ["++", "--"]:
+            self.assigns_fields = True
+        elif is_field(sym) and sym.token != "$0" and prior_sym.token == "getline":
+            self.assigns_fields = True
+
+    def note_substitution_targets(self, tokens):
+        """Spot sub() & gsub() changing a field, sub(/x/, "y", $2)"""
+        for nr in range(len(tokens) - 1):
+            if tokens[nr][1].token in ("sub", "gsub") and tokens[nr + 1][1].token == "(":
+                end = self.matching_token(tokens, nr + 1)
+                target = tokens[end - 1][1]
+                if (
+                    tokens[end - 2][1].token == ","
+                    and target.sym_type == SymType.DOLLAR
+                    and target.token != "$0"
+                ):
+                    self.assigns_fields = True
+
+    def note_separator_assignment(self, prior_sym: Sym, sym: Sym):
+        """Spot OFS = ..., getline ORS and so on. Until these, print can
+        assume OFS & ORS are strings"""
+        separators = ["OFS", "ORS"]
+        if prior_sym.token in separators and sym.token in self.assignment_operators:
+            self.assigns_separators = True
+        elif sym.token in separators and prior_sym.token in ["++", "--", "getline"]:
+            self.assigns_separators = True
+
+    def note_variable_types(self, tokens):
+        """Type inference, first half: note on each user variable what
+        the program assigns to it, or its elements, and how it uses them.
+        Assignments are "number", "string", "strnum", "unknown" or the
+        variable copied. Uses are "numeric" (arithmetic, true or false,
+        comparison with a number), "update" (++, += ...), "string"
+        (concatenation, print, subscripts, comparison with a string),
+        "print" (an element printed, which is "" when missing whatever the
+        array), "length", "neutral" (for ... in, delete), ("compare",
+        variable) or "unknown". See variable_types() for the second half."""
+        operand_ends = (
+            SymType.VARIABLE, SymType.NUMBER, SymType.STRING, SymType.DOLLAR,
+            SymType.RIGHT_PAREN, SymType.RIGHT_BRACKET,
+        )
+        operand_starts = (
+            SymType.VARIABLE, SymType.NUMBER, SymType.STRING, SymType.DOLLAR,
+            SymType.LEFT_PAREN, SymType.FUNCTION,
+        )
+        item_ends = (",", ")", ">", ">>", "|")
+        parens = []  # the function called, None for a user function
+        printing = None  # print or printf
+        parameters = False
+        for nr in range(1, len(tokens) - 3):
+            prior, sym, following = (token for line, token in tokens[nr - 1 : nr + 2])
+            if sym.token == "(":
+                if prior.sym_type == SymType.FUNCTION:
+                    parens.append(None if prior.user_defined else prior.token)
+                elif prior.sym_type == SymType.VARIABLE and not prior.is_built_in():
+                    parens.append(None)  # a function defined later
+                else:
+                    parens.append("")
+            elif sym.token == ")":
+                if parens:
+                    parens.pop()
+                parameters = False
+            elif sym.sym_type == SymType.STATEMENT_TERMINATOR:
+                printing = None
+            elif sym.token in ("print", "printf"):
+                printing = sym.token
+            elif isinstance(sym, SymField):
+                sym.variable.uses.add("numeric")
+            if sym.sym_type != SymType.VARIABLE or sym.is_built_in():
+                continue
+            if prior.token == "function":
+                continue
+            if parameters or (prior.token == "(" and tokens[nr - 3][1].token == "function"):
+                parameters = True  # until the )
+                sym.is_parameter = True
+                continue
+            if following.token == "(":
+                continue  # a function call
+            end = nr
+            if following.token == "[":  # an element
+                end = self.matching_token(tokens, nr + 1)
+                following = tokens[end + 1][1]
+                sym.is_array = True
+            elif prior.token in ("in", "delete"):
+                sym.is_array = True
+            element = end != nr
+            argument = (
+                parens and prior.token in ("(", ",") and following.token in (")", ",")
+            )
+            if following.token in ("++", "--") or prior.token in ("++", "--"):
+                sym.assignments.append("number")
+                sym.uses.add("update")
+            elif following.token in ("+=", "-=", "*=", "/=", "%=", "^="):
+                sym.assignments.append("number")
+                sym.uses.add("update")
+            elif following.token == "=":
+                sym.assignments.append(self.expression_type(tokens, end + 2))
+            elif prior.token == "getline":
+                sym.assignments.append("strnum")
+            elif following.token == "in" and tokens[nr - 2][1].token == "for":
+                sym.assignments.append("unknown")  # for (key in array)
+            elif following.token == "in":
+                sym.uses.add("string")  # key in array
+            elif prior.token == "delete" or (prior.token == "in" and not element):
+                sym.uses.add("neutral")
+            elif argument and parens[-1] in (None, "sub", "gsub", "split", "patsplit"):
+                sym.assignments.append("unknown")  # the function may change it
+                sym.uses.add("unknown")
+            elif argument and parens[-1] in self.number_argument_functions:
+                sym.uses.add("numeric")
+            elif argument and parens[-1] in self.string_argument_functions:
+                sym.uses.add("length" if parens[-1] == "length" else "string")
+            elif argument and parens[-1]:
+                sym.uses.add("unknown")
+            elif printing and prior.token in (printing, ",") and (
+                following.token in item_ends
+                or following.sym_type == SymType.STATEMENT_TERMINATOR
+            ):
+                if printing == "printf":
+                    sym.uses.add("unknown")  # depends on the format
+                else:
+                    sym.uses.add("print" if element else "string")
+            elif prior.token in ("[", ",") and following.token in ("]", ","):
+                sym.uses.add("string")  # a subscript
+            elif prior.token == "return":
+                sym.uses.add("unknown")
+            elif prior.token == "=" and (
+                following.sym_type in (SymType.STATEMENT_TERMINATOR, SymType.END_OF_INPUT)
+                or following.token in (")", ",", "]", "{", "}")
+            ):
+                sym.uses.add("unknown")  # copied, used as the copy is
+            elif prior.sym_type in operand_ends or following.sym_type in operand_starts:
+                sym.uses.add("string")  # concatenation
+            elif "~" in prior.token or "~" in following.token:
+                sym.uses.add("string")
+            elif following.token in self.comparison_operators:
+                sym.uses.add(self.comparison_use(tokens[end + 2][1]))
+            elif prior.token in self.comparison_operators:
+                sym.uses.add(self.comparison_use(tokens[nr - 2][1]))
+            else:
+                sym.uses.add("numeric")
+
+    def comparison_use(self, other: Sym):
+        """The use of a variable compared with other"""
+        if other.sym_type == SymType.NUMBER:
+            return "numeric"
+        if other.sym_type == SymType.STRING:
+            return "string"
+        if other.sym_type == SymType.VARIABLE:
+            if other.token in self.number_variables:
+                return "numeric"
+            if not other.is_built_in():
+                return ("compare", other)
+        return "unknown"
+
+    def expression_type(self, tokens, start: int):
+        """The type of the expression starting at tokens[start]: "number",
+        "string", "strnum", "unknown" or the variable it copies"""
+        kinds = []
+        arithmetic = concatenation = unknown = False
+        operand = False  # the last token ended an operand
+        nr = start
+        while True:
+            sym = tokens[nr][1]
+            token = sym.token
+            if (
+                sym.sym_type in (SymType.STATEMENT_TERMINATOR, SymType.END_OF_INPUT)
+                or token in (")", ",", "]", "{")
+            ):
+                break
+            following = tokens[nr + 1][1].token
+            kind = None
+            if sym.sym_type == SymType.NUMBER:
+                if operand and token[0] == "-":  # a - 1
+                    arithmetic = True
+                else:
+                    kind = "number"
+            elif sym.sym_type == SymType.STRING:
+                kind = "string"
+            elif sym.sym_type == SymType.DOLLAR:
+                kind = "strnum"
+                if following == "(":  # $(expression)
+                    nr = self.matching_token(tokens, nr + 1)
+            elif sym.sym_type == SymType.VARIABLE:
+                if following in ("(", "["):
+                    kind = "unknown"  # a user function or element
+                    nr = self.matching_token(tokens, nr + 1)
+                elif sym.is_built_in():
+                    kind = "number" if token in self.number_variables else "unknown"
+                else:
+                    kind = sym
+            elif sym.sym_type == SymType.FUNCTION:
+                if token in self.number_functions:
+                    kind = "number"
+                elif token in self.string_functions:
+                    kind = "string"
+                else:
+                    kind = "unknown"
+                if following == "(":
+                    nr = self.matching_token(tokens, nr + 1)
+            elif token == "(":
+                kind = self.expression_type(tokens, nr + 1)
+                nr = self.matching_token(tokens, nr)
+            elif token in ("+", "-", "*", "/", "%", "^", "**", "++", "--"):
+                arithmetic = True
+            else:
+                unknown = True  # comparisons, assignments, getline ...
+            if kind is not None:
+                concatenation = concatenation or operand
+                kinds.append(kind)
+                operand = True
+            else:
+                operand = token in ("++", "--") and operand
+            nr += 1
+        if unknown or not kinds:
+            return "unknown"
+        if concatenation:
+            return "string"
+        if arithmetic:
+            return "number"
+        return kinds[0] if len(kinds) == 1 else "unknown"
+
+    def matching_token(self, tokens, start: int) -> int:
+        """The index of the ) or ] matching the ( or [ at tokens[start]"""
+        opening = tokens[start][1].token
+        closing = {"(": ")", "[": "]"}[opening]
+        depth = 0
+        for nr in range(start, len(tokens) - 1):
+            sym = tokens[nr][1]
+            depth += {opening: 1, closing: -1}.get(sym.token, 0)
+            if depth == 0 or sym.sym_type == SymType.END_OF_INPUT:
+                return nr
+        return nr
+
+    def variable_types(self) -> dict:
+        """Type inference, second half: the type of each user variable
+        (or its elements), from the assignments note_variable_types()
+        found. Copies are followed, optimistically where variables are
+        copied to each other. Variables the program never assigns are
+        "unknown", as are those assigned more than one type."""
+        variables = [
+            sym
+            for sym in self.syms.values()
+            if isinstance(sym, SymVariable) and not sym.is_built_in()
+        ]
+        types = {sym: (None if sym.assignments else "unknown") for sym in variables}
+        changed = True
+        while changed:
+            changed = False
+            for sym in variables:
+                kinds = {
+                    types.get(kind, "unknown") if isinstance(kind, Sym) else kind
+                    for kind in sym.assignments
+                }
+                kinds.discard(None)  # a copy of a variable not known yet
+                if not kinds:
+                    continue
+                kind = kinds.pop() if len(kinds) == 1 else "unknown"
+                if types[sym] != kind:
+                    types[sym] = kind
+                    changed = True
+        return {sym: kind or "unknown" for sym, kind in types.items()}
+
+    def specialise_variables(self):
+        """Use the types variable_types() found. Numbers that are only used
+        as numbers start as 0 rather than AwkEmptyVar, as do the elements
+        of arrays of them that aren't used before they are set, and
+        strings only used as strings start as "". Strings aren't then
+        converted to strings when concatenated, printed or used as
+        subscripts. Scalar function parameters get the same initial values
+        as defaults; array ones are given a new array by the function when
+        they aren't passed one, a default being shared by every call.
+        Decided once the program is lexed, before any code is generated."""
+        types = self.variable_types()
+        if self.bytes_mode:
+            string_type, empty = "bytes", 'b""'
+        else:
+            string_type, empty = "str", '""'
+        for sym, kind in types.items():
+            if sym.init != "AwkEmptyVarInstance":
+                continue  # set by -v
+            uses = set()
+            for use in sym.uses:
+                if isinstance(use, tuple):  # ("compare", variable)
+                    use = "numeric" if types.get(use[1]) == "number" else "unknown"
+                uses.add(use)
+            if kind == "number" and sym.is_array:
+                # elements are set before they are printed, or never printed
+                if not (
+                    uses <= {"update", "numeric", "neutral", "length"}
+                    or uses <= {"update", "print", "neutral", "length"}
+                ):
+                    continue
+                init = "defaultdict(int)"
+            elif kind == "number":
+                if not uses <= {"update", "numeric", "neutral"}:
+                    continue
+                init = "0"
+            elif kind == "string":
+                if not uses <= {"string", "print", "neutral", "length"}:
+                    continue
+                init = f"defaultdict({string_type})" if sym.is_array else empty
+            else:
+                continue
+            self.variable_inits[sym] = init
+            if kind == "string" and not sym.is_array and not sym.is_parameter:
+                self.string_variables.add(sym.python_equivalent)
+
+    def records_loop(self, code: list) -> list:
+        """The loop over the records of a file, with the main loop's code
+        inlined. next is continue & nextfile is break, except in other
+        loops, where they raise AwkNext & AwkNextFile as in functions;
+        only then is AwkNext caught here."""
+        jumps = {}
+
+        def visit(node, in_loop):
+            for child in ast.iter_child_nodes(node):
+                if (
+                    isinstance(child, ast.Raise)
+                    and isinstance(child.exc, ast.Name)
+                    and child.exc.id in ("AwkNext", "AwkNextFile")
+                    and not in_loop
+                ):
+                    jumps[child.lineno] = "continue" if child.exc.id == "AwkNext" else "break"
+                loop = isinstance(child, (ast.For, ast.While, ast.FunctionDef, ast.Lambda))
+                visit(child, in_loop or loop)
+
+        try:
+            tree = ast.parse("def method(self):\n" + "\n".join(code)).body[0]
+        except SyntaxError:
+            pass  # a compiler bug, which is easier to see unchanged
+        else:
+            visit(tree, False)
+        body = [
+            re.sub(r"raise AwkNext(File)?\b", jumps[nr], line, 1) if nr in jumps else line
+            for nr, line in enumerate(code, 2)  # numbered as in tree
+        ]
+        functions = self.generated_code[self.function_section]
+        indent = self.indent
+        answer = [
+            f"{indent}_set_dollar_fields = self._set_dollar_fields",
+            f"{indent}for _line in records:",
+            f"{indent}    _set_dollar_fields(_line)",
+            f"{indent}    self.NR += 1",
+            f"{indent}    self.FNR += 1",
+        ]
+        if any(re.search(r"raise AwkNext\b", line) for line in body + functions):
+            answer.append(f"{indent}    try:")
+            answer.extend("        " + line for line in body)
+            answer.extend([f"{indent}    except AwkNext:", f"{indent}        pass"])
+        else:
+            answer.extend("    " + line for line in body)
+        return answer
+
+    def hoist_globals(self, code: list) -> list:
+        """Python locals are much faster than attributes of self, so
+        variables a method uses more than once, or in a loop, are copied
+        into locals when it starts (x_ = self.x). Those it changes are
+        copied back where other code could see them: before user function
+        calls, getline & raise (next, exit ...), and at the end. Variables
+        the functions change, & those set by name (getline var, ++ in
+        expressions), are left alone, as are built in variables other
+        than a few the runtime only changes between records, and NR & FNR
+        which records_loop() counts."""
+        try:
+            tree = ast.parse("def method(self):\n" + "\n".join(code)).body[0]
+        except SyntaxError:
+            return code  # a compiler bug, which is easier to see unchanged
+        source = "\n".join(code)
+        functions = "\n".join(self.generated_code[self.function_section])
+        calls = re.compile(
+            "|".join(
+                re.escape(sym.python_equivalent) + r"\("
+                for sym in self.syms.values()
+                if isinstance(sym, SymFunction) and sym.user_defined
+            )
+            or "(?!)"
+        )
+        calls_functions = calls.search(source) is not None
+        getline = "get_into_" in source or calls_functions and "get_into_" in functions
+        observers = [
+            nr
+            for nr, line in enumerate(code, 2)  # numbered as in tree
+            if calls.search(line) or "get_into_" in line or line.lstrip().startswith("raise")
+        ]
+
+        def changed_elsewhere(name):
+            """set by name, or by a function the method calls"""
+            return (
+                f'"{name}"' in source + functions
+                or f"'{name}'" in source + functions
+                or calls_functions
+                and re.search(rf"self\.{name}\b\s*([^\s.(=]*=(?!=)|,)", functions)
+            )
+
+        # which attributes of self are read & written, weighting loops
+        weights, stores, nested_stores = defaultdict(int), set(), set()
+
+        def visit(node, weight, nested):
+            for child in ast.iter_child_nodes(node):
+                if (
+                    isinstance(child, ast.Attribute)
+                    and isinstance(child.value, ast.Name)
+                    and child.value.id == "self"
+                ):
+                    weights[child.attr] += weight
+                    if isinstance(child.ctx, (ast.Store, ast.Del)):
+                        (nested_stores if nested else stores).add(child.attr)
+                loop = isinstance(child, (ast.For, ast.While))
+                function = isinstance(child, (ast.FunctionDef, ast.Lambda))
+                visit(child, weight * 16 if loop else weight, nested or function)
+
+        visit(tree, 1, False)
+        hoisted, changed = [], []
+        for name, weight in weights.items():
+            sym = self.syms.get(name)
+            if weight < 2 or f"self.{name}(" in source:
+                continue  # not used enough to be worth it, or a method
+            if name in ("_record", "_std_in_out"):
+                hoisted.append(name)  # set up before BEGIN
+            elif name in self.hoistable_variables:
+                if changed_elsewhere(name):
+                    continue
+                if getline and name in ("FNR", "NR", "FILENAME"):
+                    continue  # getline moves on to the next record
+                if name in nested_stores:
+                    continue  # a local of the nested function
+                if name not in stores:
+                    hoisted.append(name)
+                elif name in ("FNR", "NR"):
+                    hoisted.append(name)  # counted by the records loop
+                    changed.append(name)
+            elif (
+                isinstance(sym, SymVariable)
+                and not sym.is_built_in()
+                and sym.python_equivalent == f"self.{name}"
+                and not changed_elsewhere(name)
+                and name not in nested_stores  # (a local of the nested function)
+            ):
+                hoisted.append(name)
+                if name in stores:
+                    changed.append(name)
+        # copy the changed variables back before the statements observers are in
+        statements = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.stmt) and node is not tree:
+                header_end = node.body[0].lineno - 1 if hasattr(node, "body") else node.end_lineno
+                for nr in range(node.lineno, header_end + 1):
+                    statements[nr] = node
+        copy_back = {statements[nr].lineno for nr in observers if nr in statements}
+        if any(code[nr - 2].lstrip().startswith(("elif", "while")) for nr in copy_back):
+            # nowhere to copy them back before the test
+            hoisted = [name for name in hoisted if name not in changed]
+            changed, copy_back = [], set()
+        if not hoisted:
+            return code
+        answer = [f"{self.indent}{name}_ = self.{name}" for name in hoisted]
+        names = re.compile(r"(?<![\w.'\"])self\.(" + "|".join(hoisted) + r")\b(?!\()")
+        for nr, line in enumerate(code, 2):
+            if nr in copy_back and changed:
+                indent = line[: len(line) - len(line.lstrip())]
+                answer.extend(f"{indent}self.{name} = {name}_" for name in changed)
+            answer.append(names.sub(r"\1_", line))
+        answer.extend(f"{self.indent}self.{name} = {name}_" for name in changed)
+        return answer
+
+    def field_projection(self) -> int:
+        """The number of fields the program can see, 0 if that's all of them.
+        Only safe when NF isn't used and fields are never assigned, as
+        either can expose the unsplit remainder of the record."""
+        if self.dynamic_fields or self.uses_NF or self.assigns_fields:
+            return 0
+        return self.max_field_used
+
     def advance_token(self):
         """Expose the current token, as well as the prior and next tokens
         to the parser.
@@ -758,6 +1316,56 @@ class AwkPyCompiler:
 
     """Expressions & conditions"""
 
+    def string_literal(self, token: str) -> str:
+        """Python for the AWK string constant token, bytes in bytes mode"""
+        if not self.bytes_mode:
+            return token
+        return "b" + bytes_escaped(token)
+
+    def to_text(self, expression: str) -> str:
+        """Python converting expression to a string, bytes in bytes mode.
+        Numbers are converted using CONVFMT"""
+        if self.bytes_mode:
+            text, to_text = "bytes", "self._bytes_value"
+        else:
+            text, to_text = "str", "self._string_value"
+        if match := self.field_regex.match(expression):
+            return f"self._record.text({match.group(1)})"
+        if expression in self.string_variables:
+            return expression
+        if self.print_simple_regex.match(expression):
+            return f"({expression} if {expression}.__class__ is {text} else {to_text}({expression}))"
+        return f"{to_text}({expression})"
+
+    def field_index(self, field: str) -> str:
+        """Python for the n of $n, from the Python for $n"""
+        if match := self.field_regex.match(field):
+            return match.group(1)
+        self.syntax_error("a field")
+
+    def subscript(self, index: str) -> str:
+        """Python for an array subscript. Floats are converted by the
+        runtime, fields are their text; constants & multiple subscripts
+        are left as is"""
+        if (
+            "," in index
+            or self.print_literal_regex.match(index)
+            or self.print_integer_regex.match(index)
+            or index == self.syms["$0"].python_equivalent
+        ):
+            return index
+        if match := self.field_regex.match(index):
+            return f"self._record.text({match.group(1)})"
+        if index in self.string_variables:
+            return index
+        if self.print_simple_regex.match(index):
+            return f"{index} if {index}.__class__ is not float else self._subscript({index})"
+        return f"self._subscript({index})"
+
+    @staticmethod
+    def is_string_literal(expression: str) -> bool:
+        return expression.startswith(('"', 'b"'))
+
     def compile_regex(self, variable, test):
         """pattern match variable against next"""
         pfx, sfx = (" not (", ")") if test == "!~" else (" ", "")
@@ -769,19 +1377,26 @@ class AwkPyCompiler:
             regex = f"self._dynamic_regex({self.current_token.python_equivalent})"
         elif self.current_token.sym_type == SymType.STRING:
             if not hasattr(self.current_token, "regex"):
-                self.current_token.regex = SymRegex(self.current_token.token)
+                self.current_token.regex = SymRegex(
+                    self.current_token.token, bytes_mode=self.bytes_mode
+                )
             regex = self.current_token.regex.python_equivalent
         else:  # Something wrong
             self.syntax_error("regular expression")
-        return pfx + f"{regex}.search(str({variable}))" + sfx
+        return pfx + f"{regex}.search({self.to_text(variable)})" + sfx
 
-    def compile_uni_operator(self, ans: list = []) -> list:
+    def compile_uni_operator(self, ans: list = None) -> list:
+        if ans is None:
+            ans = []
         if self.current_token.token in ["++", "--"]:  # pre_inc / pre_dec
             op = self.current_token.token
-            self.advance_token_require(sym_types=[SymType.VARIABLE])
+            self.advance_token_require(sym_types=[SymType.VARIABLE, SymType.DOLLAR])
             var = self.current_token
             var_parts = var.python_equivalent.split(".", 1)
-            if self.lookahead_token.token == "[":
+            if var.sym_type == SymType.DOLLAR:
+                op_fun = "_pre_inc_field" if op == "++" else "_pre_dec_field"
+                ans.append(f"self.{op_fun}({self.field_index(var.python_equivalent)})")
+            elif self.lookahead_token.token == "[":
                 self.advance_token()
                 op_fun = "_pre_inc_arr" if op == "++" else "_pre_dec_arr"
                 self.advance_token()
@@ -868,15 +1483,15 @@ class AwkPyCompiler:
         temp_num_changed = f"num_changed_{self.current_token_nr}"
         args = self.parse_gather_function_args(terminators, True)
         if len(args) == 2:
-            args.append("self._FLDS[0]")
+            args.append(self.syms["$0"].python_equivalent)
         if len(args) != 3:
             self.syntax_error("2 or 3 arguments for {func})")
         repl: str = args[1]
-        if repl.startswith('"') or repl.startswith('r"'):
+        if self.is_string_literal(repl) or repl.startswith('r"'):
             repl = repl.replace(r"\&", chr(1))
             repl = repl.replace("&", r"\1")
             repl = repl.replace(chr(1), r"&")
-            if repl.startswith('"'):
+            if self.is_string_literal(repl):
                 repl = "r" + repl
         else:
             repl = f"self._dynamic_replacement({repl})"
@@ -884,8 +1499,8 @@ class AwkPyCompiler:
         if not regex.startswith("self._re_"):
             regex = f"self._dynamic_regex({regex})"
         target: str = args[2]
-        if target.startswith("self._FLDS["):
-            index = target[11:].strip("]")
+        if target == "self._record.line" or target.startswith("self._record["):
+            index = "0" if target == "self._record.line" else target[13:-1]
             temp_target = f"target_{self.current_token_nr}"
             self.output_line(
                 f"{temp_target},{temp_num_changed}={regex}.subn({repl},{target},{max_changes})"
@@ -893,8 +1508,10 @@ class AwkPyCompiler:
             if index == "0":
                 self.output_line(f"self._set_dollar_fields({temp_target})")
             else:
-                self.output_line(f"self._set_dollar_field({index},{temp_target})")
+                self.output_line(f"self._record[{index}]={temp_target}")
         elif target.startswith("self."):
+            if target in ["self.OFS", "self.ORS"]:
+                self.assigns_separators = True
             self.output_line(
                 f"{target},{temp_num_changed}={regex}.subn({repl},{target},{max_changes})"
             )
@@ -911,7 +1528,9 @@ class AwkPyCompiler:
         if func.ext_library:
             self.required_libraries[func.ext_library] = True
         args = self.parse_gather_function_args(terminators, True)
-        string_name = args[0] if str(args[0]).isidentifier() else f"str({args[0]})"
+        string_name = (
+            args[0] if str(args[0]).isidentifier() else self.to_text(args[0])
+        )
         if len(args) == 2:
             if args[1].isnumeric():
                 start = int(args[1]) - 1
@@ -939,7 +1558,7 @@ class AwkPyCompiler:
             extra_terminators=extra_terminators,
             string_terminators=string_terminators,
         )
-        if orig_args[0][0] != '"':
+        if orig_args[0][0] != '"' or self.bytes_mode:
             args = ", ".join(orig_args)
             return rf"self.sprintf({args})"
         awk = orig_args.pop(0)
@@ -1047,21 +1666,40 @@ class AwkPyCompiler:
             self.required_libraries[func.ext_library] = True
         args = self.parse_gather_function_args(terminators, True)
         # FIXME: args[0] self.fld
-        string_name = args[0] if str(args[0]).isidentifier() else f"str({args[0]})"
-        # split( str, array, fieldsep) -> array=str.split(fieldsep)
+        string_name = (
+            args[0] if str(args[0]).isidentifier() else self.to_text(args[0])
+        )
+        # split( str, array, fieldsep) -> array=self._split(str, fieldsep)
         if len(args) == 2:
             args.append("self.FS")
-        if len(args) == 3:  # split( str, array, fieldsep) -> array=str.split(fieldsep)
-            expr = f"{args[1]} = self._to_array({string_name}.split({args[2]}))"
+        if len(args) == 3:  # split( str, array, fieldsep) -> array=self._split(str, fieldsep)
+            expr = f"{args[1]} = self._to_array(self._split({string_name}, {args[2]}))"
             if position:
                 tempvar = f"parts_{self.current_token_nr}"
                 self.output_line(expr)
-                self.output_line(f"{tempvar}=len(expr)")
+                self.output_line(f"{tempvar}=len({args[1]})")
                 return tempvar
             else:
                 return expr
         self.syntax_error("2 or 3 arguments")
 
+    def compile_patsplit_function_call(self, terminators=[]):
+        """Compile patsplit( str, array[, fieldpat[, seps]])"""
+        terminators.append(SymType.RIGHT_PAREN)
+        args = self.parse_gather_function_args(terminators, True)
+        if not 2 <= len(args) <= 4:
+            self.syntax_error("2 to 4 arguments")
+        string_name = (
+            args[0] if str(args[0]).isidentifier() else self.to_text(args[0])
+        )
+        fieldpat = f", {args[2]}" if len(args) > 2 else ""
+        tempvar = f"patsplit_{self.current_token_nr}"
+        self.output_line(f"{tempvar} = self._patsplit({string_name}{fieldpat})")
+        self.output_line(f"{args[1]} = self._to_array({tempvar}[0])")
+        if len(args) == 4:
+            self.output_line(f"{args[3]} = self._to_array({tempvar}[1], 0)")
+        return f"len({tempvar}[0])"
+
     def parse_parameter_list(
         self,
         extra_terminators=[],
@@ -1121,6 +1759,7 @@ class AwkPyCompiler:
             ans = []
         last_array = None
         last_ans_len = len(ans)
+        concatenation = None  # the last, which is already a string
         while (
             self.current_token.sym_type not in terminators
             and self.current_token.token not in string_terminators
@@ -1157,7 +1796,7 @@ class AwkPyCompiler:
                     self.prior_token.is_array = True
                     self.prior_token.init = "defaultdict(AwkEmptyVar.instance)"
                     self.advance_token()
-                    last_array_index = self.compile_expression()
+                    last_array_index = self.subscript(self.compile_expression())
                     self.advance_token()  # dispose ]
                     if missing_index is None:
                         ans.append(f"[{last_array_index}]")
@@ -1180,6 +1819,11 @@ class AwkPyCompiler:
                         ans.append(
                             f"{var_parts[0]}.{op_fun}({last_array.python_equivalent},{last_array_index})"
                         )
+                    elif self.prior_token.sym_type == SymType.DOLLAR:
+                        op_fun = "_post_inc_field" if op == "++" else "_post_dec_field"
+                        ans.append(f"self.{op_fun}({self.field_index(ans.pop())})")
+                    else:
+                        self.syntax_error("a variable, array element or field before " + op)
                     self.advance_token()
                 elif self.current_token.is_operator():
                     if self.current_token.token in ["~", "!~"]:
@@ -1200,15 +1844,16 @@ class AwkPyCompiler:
                         lhs = ans.pop()
                         while lhs[0] in ".[":  # rejoin array lookups
                             lhs = ans.pop() + lhs
-                        if lhs[0] != '"':
-                            lhs = f"str({lhs})"
+                        if not self.is_string_literal(lhs) and lhs != concatenation:
+                            lhs = self.to_text(lhs)
                         if self.lookahead_token.sym_type == SymType.LEFT_BRACKET:
                             rhs = self.compile_expression(extra_terminators)
                         else:
                             rhs = self.current_token.python_equivalent
-                        if rhs[0] != '"':
-                            rhs = f"str({rhs})"
-                        ans.append(f"({lhs}+{rhs})")
+                        if not self.is_string_literal(rhs):
+                            rhs = self.to_text(rhs)
+                        concatenation = f"({lhs}+{rhs})"
+                        ans.append(concatenation)
                     if not self.current_token.sym_type in terminators:
                         self.advance_token()
                 else:
@@ -1303,7 +1948,11 @@ class AwkPyCompiler:
                 param.python_equivalent,
             )  # save for restore
             param.python_equivalent = param.token
-            parameter_list.append(f"{param.token}=AwkEmptyVarInstance")
+            if param.is_array:
+                parameter_list.append(f"{param.token}=AwkEmptyVarInstance")
+            else:
+                init = self.variable_inits.get(param, "AwkEmptyVarInstance")
+                parameter_list.append(f"{param.token}={init}")
             self.advance_token()  # discard parameter name
             if self.current_token.sym_type == SymType.COMMA:
                 self.advance_token()  # discard ,
@@ -1322,9 +1971,14 @@ class AwkPyCompiler:
             self.output_line("_locals=AwkpyRuntimeVarOwner()")
             for varname, data in parameter_dict.items():
                 var, value = data
-                self.output_line(
-                    f"_locals.{var.python_equivalent}={var.python_equivalent}"
-                )
+                name = var.python_equivalent
+                if var.is_array:  # local, unless the caller passes one
+                    init = self.variable_inits.get(var, "defaultdict(AwkEmptyVar.instance)")
+                    self.output_line(
+                        f"_locals.{name}={init} if {name} is AwkEmptyVarInstance else {name}"
+                    )
+                else:
+                    self.output_line(f"_locals.{name}={name}")
                 var.python_equivalent = f"_locals.{var.python_equivalent}"
         self.compile_statement()
         self.indent = saved_indent
@@ -1363,7 +2017,7 @@ class AwkPyCompiler:
         self.advance_token()
         if self.current_token.sym_type == SymType.LEFT_BRACKET:
             self.advance_token()
-            index = self.compile_expression([SymType.RIGHT_BRACKET])
+            index = self.subscript(self.compile_expression([SymType.RIGHT_BRACKET]))
             self.output_line(f"del {var.python_equivalent}[{index}]")
             if self.current_token.sym_type == SymType.RIGHT_BRACKET:
                 self.advance_token()
@@ -1429,49 +2083,139 @@ class AwkPyCompiler:
             """C style
                 for( init; test; incr) body
             ->
-                def _generator__token_nr(): # self & locals avail
-                    init
-                    while test:
-                        yield True
-                        incr
-                for dummy in self._generator__token_nr([locals])
+                init
+                while test:
                     body
-            # this structure allows for continue statements
+                    incr
+            with incr also before the body's continue statements, or
+            when it's a simple counter, for var in range(...): body
             """
             init = self.compile_expression()
             self.advance_token()  # dispose of ;
             test = self.compile_expression()
             self.advance_token()  # dispose of ;
             if self.current_token.sym_type != SymType.RIGHT_PAREN:
-                ## For unknown reasons incr gets doubled up under pytest
-                ## can not reproduce this otherwise
-                o1 = self.current_token
-                o2 = self.lookahead_token
-                incr = self.compile_expression()
-                if "')self" in incr:
-                    if o1.token[0] in "+-":
-                        incr = f"{o2.python_equivalent} {o1.token[0]}=1"
-                    else:
-                        incr = f"{o1.python_equivalent} {o2.token[0]}=1"
+                incr = self.increment_statement(self.compile_expression())
             else:
                 incr = ""
             if self.current_token.sym_type == SymType.RIGHT_PAREN:
                 self.advance_token()  # dispose of )
-            # former_output_section = self.current_output
-            # self.current_output=self.function_section
-            generator_name = f"_generator__{self.current_token_nr}"
-            dummy_name = f"_dummy__{self.current_token_nr}"
-            self.output_line(f"def {generator_name}():")
+            saved_output = self.start_defer_output()
+            self.compile_indented_statement()
+            body = self.end_deferred_output(saved_output)
+            if counter := self.counting_loop(init, test, incr, body):
+                header, body, after = counter
+                self.output_line(header)
+                self.output_block(body)
+                for line in after:
+                    self.output_line(line)
+                return
             if init.strip() != "":
-                self.output_line(f"    {init}")
+                self.output_line(init)
             if test.strip() == "":
                 test = "True"
-            self.output_line(f"    while {test}:")
-            self.output_line(f"        yield True")
+            self.output_line(f"while {test}:")
             if incr.strip() != "":
-                self.output_line(f"        {incr} #")
-            self.output_line(f"for {dummy_name} in {generator_name}():")
-            self.compile_indented_statement()
+                jumps = self.loop_jumps(body)
+                for nr in sorted(jumps["continue"], reverse=True):
+                    line = body[nr]
+                    column = len(line) - len(line.lstrip())
+                    body[nr] = f"{line[:column]}{incr}; {line[column:]}"
+                body.append(f"{self.indent}    {incr}")
+            self.output_block(body)
+
+    def loop_jumps(self, body: list) -> dict:
+        """The indexes of the lines of body holding its own break &
+        continue statements, not those of loops inside it"""
+        jumps = {"break": set(), "continue": set()}
+        try:
+            tree = ast.parse("while True:\n" + "\n".join(body)).body[0]
+        except SyntaxError:
+            return jumps  # a compiler bug, which is easier to see unchanged
+
+        def visit(node):
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, ast.Break):
+                    jumps["break"].add(child.lineno - 2)
+                elif isinstance(child, ast.Continue):
+                    jumps["continue"].add(child.lineno - 2)
+                elif not isinstance(child, (ast.For, ast.While, ast.FunctionDef, ast.Lambda)):
+                    visit(child)
+
+        visit(tree)
+        return jumps
+
+    def counting_loop(self, init: str, test: str, incr: str, body: list):
+        """for(i=a;i<=b;i++) body is for i in range(a, b+1): body, which
+        is much faster, when a & b are integers the body can't change,
+        and nor can it change i, which is left as awk would, one past b.
+        Returns (header, body, lines after the loop) or None."""
+        bound = r"(-?\d+|self\.(?:NF|NR|FNR))"
+        match = re.fullmatch(rf"((?:self|_locals)\.(\w+))={bound}", init.strip())
+        if not match:
+            return None
+        var, name, first = match.groups()
+        match = re.fullmatch(rf"{re.escape(var)}(<=?|>=?){bound}", test.strip())
+        if not match or incr != f"{var}{'+' if match[1][0] == '<' else '-'}=1":
+            return None
+        comparison, limit = match.groups()
+        try:
+            tree = ast.parse("while True:\n" + "\n".join(body)).body[0]
+        except SyntaxError:
+            return None
+        source = "\n".join(body)
+        calls = re.compile(
+            "|".join(
+                re.escape(sym.python_equivalent) + r"\("
+                for sym in self.syms.values()
+                if isinstance(sym, SymFunction) and sym.user_defined
+            )
+            or "(?!)"
+        )
+        stores = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                # set by name: getline var, ++ in expressions ...
+                stores.update(
+                    arg.value
+                    for arg in node.args
+                    if isinstance(arg, ast.Constant) and isinstance(arg.value, str)
+                )
+            elif isinstance(node, (ast.Attribute, ast.Subscript)) and isinstance(
+                node.ctx, (ast.Store, ast.Del)
+            ):
+                target = node if isinstance(node, ast.Attribute) else node.value
+                if isinstance(target, ast.Attribute):
+                    stores.add(target.attr)
+        if name in stores or var.startswith("self.") and calls.search(source):
+            return None  # the body can change the counter
+        for value in (first, limit):
+            if value.startswith("self.") and (
+                value[5:] in stores
+                or value == "self.NF" and "_record" in stores
+                or calls.search(source)
+                or "get_into_" in source
+                or "_set_dollar_fields" in source
+            ):
+                return None  # or the range
+        if comparison[0] == "<":
+            step, offset, last = "", 0 if comparison == "<" else 1, max
+        else:
+            step, offset, last = ", -1", 0 if comparison == ">" else -1, min
+        if limit.lstrip("-").isdigit():
+            end = str(int(limit) + offset)
+        else:
+            end = f"{limit}{offset:+}" if offset else limit
+        if first.lstrip("-").isdigit() and end.lstrip("-").isdigit():
+            after = [f"{var}={last(int(first), int(end))}"]
+        else:
+            after = [f"{var}={last.__name__}({first}, {end})"]
+        # the counter is an int, so needs no int() as a field number
+        uses = re.compile(rf"(?<![\w.])int\({re.escape(var)}\)")
+        body = [uses.sub(var, line) for line in body]
+        if self.loop_jumps(body)["break"]:
+            after = ["else:", "    " + after[0]]  # only if it isn't broken out of
+        return f"for {var} in range({first}, {end}{step}):", body, after
 
     def compile_getline_common(self, pipe, terminator):
         self._has_mainloop = True  # ref Posix spec. Their rationale unknown to me.
@@ -1534,36 +2278,105 @@ class AwkPyCompiler:
 
     def compile_print_statement(self):
         self.advance_token()  # discard "print"
-        ans = "print("
         redirects = [">", ">>", "|"]
         fields = self.parse_parameter_list(
             string_terminators=redirects, missing_index='""'
         )
         file_name = self.compile_print_common()
         self.consume_terminator()
+        file = "file_handle" if file_name else "self._std_in_out"
+        record = self.syms["$0"].python_equivalent
         if len(fields) == 0:  # print; == print $0;
-            ans += "self._FLDS[0]"
+            fields = [record]
+        if self.csv_mode and fields != [record]:
+            # print $0 writes the record as read, anything else is quoted
+            fields = ",".join(self.print_value(fld, False)[1] for fld in fields)
+            self.output_line(
+                f"{file}.print_csv({fields}, sep=self.OFS, end=self.ORS)"
+            )
         else:
-            for i in range(len(fields)):
-                fld = fields[i]
-                if len(fld) > 1:
-                    if (
-                        fld.startswith('"')
-                        or fld.startswith('("')
-                        or fld.startswith("str(")
-                        or fld.startswith("str(")
-                    ):
-                        continue
-                    fields[i] = f"self.awkpy__to_string({fld})"
-            ans += ",".join(fields) + ", sep=self.OFS, end=self.ORS"
-        if file_name:
-            ans = "file_handle." + ans
-        ans += ")"
-        self.output_line(ans)
+            self.output_print(file, fields)
+
+    def output_print(self, file, fields):
+        """Output print as one string, written to the output buffer of file.
+
+        The string is built assuming that OFS, ORS & the fields are strings,
+        as they are unless the program assigns them. If it turns out to,
+        compile() swaps in a version that converts them.
+        """
+        fast = f"{file}.output.write({self.print_string(fields, trusted=True)})"
+        safe = f"{file}.output.write({self.print_string(fields, trusted=False)})"
+        self.output_line(fast)
+        if safe != fast:
+            self.print_alternatives[fast] = safe
+
+    def print_value(self, field: str, trusted: bool):
+        """(kind, Python for field), kind being "literal" for a constant,
+        "string" if it gives a string (bytes in bytes mode) or "object"
+        if it's only expected to, so is formatted like one"""
+        if self.bytes_mode:
+            text, to_string = "(bytes,)", "self.awkpy__to_bytes"
+            converted = ('b"', '(b"', "self.awkpy__to_bytes(", "self._bytes_value(")
+        else:
+            text, to_string = "(str, int)", "self.awkpy__to_string"
+            converted = ('"', '("', "self.awkpy__to_string(", "self._string_value(")
+        if self.print_literal_regex.match(field):
+            return "literal", field
+        if self.print_integer_regex.match(field):
+            return "literal", self.string_literal(f'"{int(field)}"')
+        if field == self.syms["$0"].python_equivalent:
+            return "string", field
+        if trusted and (match := self.field_regex.match(field)):
+            return "string", f"self._record.text({match.group(1)})"
+        if field.startswith(converted):
+            return "object", field
+        if field in self.string_variables:
+            return "string", field
+        if self.print_simple_regex.match(field):
+            # strings, & in text mode ints, print as they are
+            return "string", f"{field} if {field}.__class__ in {text} else {to_string}({field})"
+        return "string", f"{to_string}({field})"
+
+    def print_string(self, fields, trusted: bool) -> str:
+        """Python for the record print writes: the fields joined by OFS,
+        followed by ORS. An f-string, unless in bytes mode or a field is
+        too complex to go in one."""
+        to_string = "self.awkpy__to_bytes" if self.bytes_mode else "self.awkpy__to_string"
+        ofs, ors = "self.OFS", "self.ORS"
+        if not trusted:
+            ofs, ors = f"{to_string}({ofs})", f"{to_string}({ors})"
+        values = [self.print_value(field, trusted) for field in fields]
+        if self.bytes_mode or not all(
+            kind == "literal" or self.print_fstring_safe_regex.match(value)
+            for kind, value in values
+        ):
+            values = [
+                f"{to_string}({value})" if kind == "object" else value
+                for kind, value in values
+            ]
+            if len(values) == 1:
+                return f"{values[0]} + {ors}"
+            return f"{ofs}.join(({', '.join(values)})) + {ors}"
+        # f-strings & literals, which Python concatenates when compiling
+        pieces = []
+        replacements = []
+        for i, (kind, value) in enumerate(values):
+            if i > 0:
+                replacements.append(ofs)
+            if kind == "literal":
+                if replacements:
+                    pieces.append("f'{" + "}{".join(replacements) + "}'")
+                    replacements = []
+                pieces.append(value)
+            else:
+                replacements.append(value)
+        replacements.append(ors)
+        pieces.append("f'{" + "}{".join(replacements) + "}'")
+        return " ".join(pieces)
 
     def compile_printf_statement(self):
         self.advance_token()  # discard "print"
-        ans = "print("
+        ans = "write("
         redirects = [">", ">>", "|"]
         ans += self.compile_sprintf_function_call(string_terminators=redirects)
         if self.current_token.sym_type == SymType.RIGHT_PAREN:
@@ -1572,7 +2385,9 @@ class AwkPyCompiler:
         self.consume_terminator()
         if file_name:
             ans = "file_handle." + ans
-        ans += ",end='')"
+        else:
+            ans = "self._std_in_out." + ans
+        ans += ")"
         self.output_line(ans)
 
     def compile_block(self):
@@ -1596,12 +2411,18 @@ class AwkPyCompiler:
         elif self.current_token.sym_type in [
             SymType.LEFT_PAREN,
             SymType.VARIABLE,
+            SymType.DOLLAR,
             SymType.FUNCTION,
             SymType.AMBIGUOUSOPERATOR,
             SymType.UNIOPERATOR,
             SymType.STRING,
         ]:
-            prog = self.compile_expression()
+            if self.current_token.token == "$0" and self.lookahead_token.token == "=":
+                self.advance_token()
+                self.advance_token()
+                prog = f"self._set_dollar_fields({self.compile_expression()})"
+            else:
+                prog = self.increment_statement(self.compile_expression())
             if (
                 "|" in self.current_token.token
                 and self.lookahead_token.token == "getline"
@@ -1618,6 +2439,21 @@ class AwkPyCompiler:
         if prog and prog != "":
             self.output_line(prog)
 
+    def increment_statement(self, prog: str) -> str:
+        """x++, ++x, a[k]-- ... on their own don't need the value the
+        _post_inc_var() etc. helpers return, so are x+=1, a[k]-=1 ..."""
+        if match := self.increment_var_regex.match(prog):
+            owner, op, name = match.groups()
+            return f"{owner}.{name}{'+' if op == 'inc' else '-'}=1"
+        if match := self.increment_arr_regex.match(prog):
+            op, array, key = match.groups()
+            return f"{array}[{key}]{'+' if op == 'inc' else '-'}=1"
+        if match := self.increment_field_regex.match(prog):
+            op, nr = match.groups()
+            if nr != "0":  # $0 is the record's text
+                return f"self._record[{nr}]{'+' if op == 'inc' else '-'}=1"
+        return prog
+
     def compile_indented_statement(self):
         """Indent the output then compile"""
         saved_indent = self.indent
@@ -1656,7 +2492,7 @@ class AwkPyCompiler:
             ]:
                 prog = self.compile_condition("{")
             elif self.current_token.token == "/" or self.current_token.is_regex():
-                prog = self.compile_regex("self._FLDS[0]", "~")
+                prog = self.compile_regex(self.syms["$0"].python_equivalent, "~")
                 if self.current_token.is_regex() or self.current_token.token == "/":
                     self.advance_token()
             else:
@@ -1668,11 +2504,14 @@ class AwkPyCompiler:
             if self.current_token.sym_type == SymType.LEFT_BRACE:
                 self.compile_indented_statement()
             else:
+                record = self.syms["$0"].python_equivalent
                 self.output_line(
-                    r"    print(self._FLDS[0], sep=self.OFS, end=self.ORS)"
+                    f"    self._std_in_out.print({record}, sep=self.OFS, end=self.ORS)"
                 )
 
-    def compile_to_segments(self, source):
+    def lex_segment(self, source):
+        """The tokens of an awk source: a program, or -f, -i or -e and
+        its file name or program. None for a file already included"""
         if len(source) > 2 and source[0:2] == "-f":
             filename = source[2:]
             if filename in self.included_files:
@@ -1690,7 +2529,7 @@ class AwkPyCompiler:
                     f"{filename} can't be used as both included and as a source file "
                 )
             if filename in self.included_files:
-                return
+                return None
             self.included_files.append(filename)
             file = open(filename, mode="r")
             source = file.read()
@@ -1700,7 +2539,10 @@ class AwkPyCompiler:
             source = source[2:]
         else:
             filename = "command line"
-        self.tokens = self.lex_string(filename, source + "\n")
+        return self.lex_string(filename, source + "\n")
+
+    def compile_to_segments(self, tokens):
+        self.tokens = tokens
         self.current_token_nr = -2
         self.advance_token()
         self.advance_token()
@@ -1716,11 +2558,18 @@ class AwkPyCompiler:
 
     def parse_args(self, source):
         files = []
+        # before the -v values, which are bytes in bytes mode
+        self.bytes_mode = "-b" in source
+        self.csv_mode = "--csv" in source
+        self.hoist_globals_mode = "-Wnohoist" not in source
         # Experiments show Gawk excludes options from ARGC & ARGV
         i = 0
         while i < len(source):
             arg = source[i]
             if arg[0] == "-":
+                if arg == "--csv":  # print quotes, see compile_print_statement
+                    i += 1
+                    continue
                 if arg[1] == "-":
                     if len(arg) > 2:  # gnu style arg
                         print(f"{arg}: Gnu style arguments not implemented")
@@ -1773,16 +2622,15 @@ class AwkPyCompiler:
                             python_equivalent=namespace.python_equivalent + setvar,
                         )
                         self.syms[setvar_key] = sym
-                    # HEURISTIC: if the value is a number, leave it and let Python
-                    # convert it to one
-                    # If the value is not a number, surround with quotes.
-                    # Damned if I know if this is the correct thing to do
-                    # it duplicates what we do in the runtime so if we change
+                    # The value is a numeric string, as in awk. This
+                    # duplicates what we do in the runtime so if we change
                     # one we should change both.
-                    try:
-                        discard = float(val)
-                    except:
+                    if self.bytes_mode:
+                        val = repr(val.encode("utf-8", "surrogateescape"))
+                    else:
                         val = 'r"""' + val + '"""'
+                    if setvar_key not in ["OFS", "ORS"]:  # always strings
+                        val = f"{'AwkBytesNum' if self.bytes_mode else 'AwkStrNum'}({val})"
                     sym.init = val
                     sym.built_in = False
             else:
@@ -1818,16 +2666,47 @@ class AwkPyCompiler:
 
     def compile(self, args):
         if isinstance(args, list):
-            files = self.parse_args(args)
-            for s in files:
-                self.compile_to_segments(s)
+            sources = self.parse_args(args)
         else:
-            self.compile_to_segments(args)
+            sources = [args]
+        # all lexed before any is compiled, so it's known whether fields are
+        # assigned, in which case $0 may need rebuilding before it's used
+        segments = [self.lex_segment(source) for source in sources]
+        if self.assigns_fields:
+            self.syms["$0"].python_equivalent = "self._record[0]"
+        self.specialise_variables()
+        for tokens in segments:
+            if tokens is not None:
+                self.compile_to_segments(tokens)
 
         self.current_output = 0  # __init__
-        self.output_line("super().__init__()")
+        if self.bytes_mode:
+            self.output_line("super().__init__(bytes_mode=True)")
+        else:
+            self.output_line("super().__init__()")
+        if self.csv_mode:
+            self.output_line('self.OFS = b","' if self.bytes_mode else 'self.OFS = ","')
         if self._has_mainloop:
             self.output_line("self._has_mainloop = True")
+        if max_field := self.field_projection():
+            self.output_line(f"self._max_field = {max_field}")
+        if self.assigns_separators or self.assigns_fields:
+            # print can't assume OFS, ORS & the fields are strings
+            for code in self.generated_code:
+                for index, line in enumerate(code):
+                    for fast, safe in self.print_alternatives.items():
+                        if fast in line:
+                            line = code[index] = line.replace(fast, safe)
+        if self.string_variables:
+            # var=value on the command line sets these to plain strings
+            names = ", ".join(repr(name[5:]) for name in sorted(self.string_variables))
+            self.output_line(f"self._string_variables = frozenset({{{names}}})")
+        if self._has_mainloop and len(self.generated_code[3]) > 0:
+            self.generated_code[3] = self.records_loop(self.generated_code[3])
+        if self.hoist_globals_mode:
+            for section in range(1, 6):  # BEGIN ... END
+                code = self.generated_code[section]
+                code[:] = self.hoist_globals(code)
 
         for name, sym in self.syms.items():
             if sym.is_variable():
@@ -1836,7 +2715,8 @@ class AwkPyCompiler:
                         f"{sym.token} is used as both an array and a scalar value"
                     )
                 if not sym.is_built_in():
-                    self.output_line(f"{sym.python_equivalent}={sym.init}")
+                    init = self.variable_inits.get(sym, sym.init)
+                    self.output_line(f"{sym.python_equivalent}={init}")
             elif sym.is_regex():
                 self.output_line(f"{sym.python_equivalent}={sym.init}")
             elif hasattr(sym, "regex"):
@@ -1850,7 +2730,7 @@ class AwkPyCompiler:
         prefix.extend(self.header_comments)
         for (
             item
-        ) in "AwkpyRuntimeVarOwner,AwkpyRuntimeWrapper,AwkNext,AwkNextFile,AwkExit,AwkEmptyVar,AwkEmptyVarInstance".split(
+        ) in "AwkpyRuntimeVarOwner,AwkpyRuntimeWrapper,AwkNext,AwkNextFile,AwkExit,AwkEmptyVar,AwkEmptyVarInstance,AwkStrNum,AwkBytesNum".split(
             ","
         ):
             self.required_library_items["awkpy_runtime"][item] = True
@@ -1875,13 +2755,10 @@ class AwkPyCompiler:
             "__init__(self)",
             "awkpy__BEGIN",
             "awkpy__BEGINFILE",
-            "awkpy__MAINLOOP",
+            "awkpy__RECORDS(self, records)",
             "awkpy__ENDFILE",
             "awkpy__END",
         ]
-        if self._has_mainloop and len(self.generated_code[3]) > 0:
-            self.generated_code[3].insert(0, "      try:")
-            self.generated_code[3].extend(["      except AwkNext:", "        pass"])
         for outputNr in range(6):
             if len(self.generated_code[outputNr]) > 0:
                 fn = fns[outputNr]
@@ -1895,6 +2772,8 @@ class AwkPyCompiler:
     def __init__(self, compile_to_disk=False, debug=False):
         self.do_debug = debug
         self.compile_to_disk = compile_to_disk
+        self.bytes_mode = False  # -b, strings are bytes rather than str
+        self.csv_mode = False  # --csv, print writes CSV
         self.generated_code = [
             [],
             [],
@@ -1909,6 +2788,45 @@ class AwkPyCompiler:
         self.line_comment = ""
         self.current_output = 3  # body
         self._has_mainloop = False
+        # field projection analysis, see field_projection()
+        self.assignment_operators = ["=", "+=", "-=", "*=", "/=", "%=", "^=", "++", "--"]
+        self.max_field_used = 0
+        self.dynamic_fields = False
+        self.uses_NF = False
+        self.assigns_fields = False
+        # print code generation, see compile_print_statement()
+        self.assigns_separators = False
+        self.print_alternatives = {}
+        # type inference, see note_variable_types() & specialise_variables()
+        self.variable_inits = {}  # SymVariable: its specialised initial value
+        self.string_variables = set()  # the Python of those only holding strings
+        self.number_functions = [
+            "atan2", "close", "cos", "exp", "fflush", "gsub", "index", "int",
+            "length", "log", "match", "patsplit", "rand", "sin", "split",
+            "sqrt", "sub", "system",
+        ]
+        self.string_functions = ["sprintf", "substr", "tolower", "toupper"]
+        self.number_argument_functions = ["atan2", "cos", "exp", "int", "log", "sin", "sqrt"]
+        self.string_argument_functions = ["index", "length", "match", "tolower", "toupper"]
+        self.comparison_operators = ["<", "<=", "==", "!=", ">", ">="]
+        self.number_variables = ["ARGC", "ARGIND", "FNR", "NF", "NR", "RLENGTH", "RSTART"]
+        self.increment_var_regex = re.compile(r"^(\w+)\._(?:pre|post)_(inc|dec)_var\('(\w+)'\)$")
+        self.increment_arr_regex = re.compile(
+            r"^\w+\._(?:pre|post)_(inc|dec)_arr\(((?:\w+\.)?\w+),(.*)\)$"
+        )
+        self.increment_field_regex = re.compile(r"^self\._(?:pre|post)_(inc|dec)_field\((.*)\)$")
+        # globals copied into locals, see hoist_globals()
+        self.hoist_globals_mode = True  # -Wnohoist turns it off
+        self.hoistable_variables = ["FILENAME", "FNR", "NR", "OFS", "ORS", "SUBSEP"]
+        self.print_literal_regex = re.compile(r'^b?"([^"\\\n]|\\.)*"$')
+        self.print_integer_regex = re.compile(r"^-?[0-9]+$")
+        self.print_field_regex = re.compile(r"^self\._record\[[0-9]+\]$")
+        self.field_regex = re.compile(r"^self\._record\[([^\[\]]+)\]$")
+        self.print_simple_regex = re.compile(
+            r"^([A-Za-z_][A-Za-z_0-9.]*|self\._record\[[0-9]+\])$"
+        )
+        # no quotes, backslashes or anything else with a meaning in f'{...}'
+        self.print_fstring_safe_regex = re.compile(r"^[^'\\{}:#!\n]*$")
         """regular expression that should recognise all awk symbols"""
         comment = r"#.*$"
         string = r'"(([^\\](\\\\)*\\")|([^"\n]))*("|$)'
@@ -1950,7 +2868,7 @@ class AwkPyCompiler:
             Sym(")", SymType.RIGHT_PAREN, 1, 1),
             # Field reference
             Sym("$", SymType.DOLLAR, 2, -1),
-            Sym("$0", SymType.DOLLAR, 2, -1, python_equivalent="self._FLDS[0]"),
+            Sym("$0", SymType.DOLLAR, 2, -1, python_equivalent="self._record.line"),
             # unary operators
             SymUnaryOperator("--", SymType.UNIOPERATOR, 3, -1),
             SymUnaryOperator("++", SymType.UNIOPERATOR, 3, -1),
@@ -2013,7 +2931,9 @@ class AwkPyCompiler:
             SymVariable("ARGIND", built_in=True, scalar=True),
             SymVariable("CONVFMT", built_in=True, scalar=True),
             SymVariable("ENVIRON", built_in=True, array=True),
+            SymVariable("FIELDWIDTHS", built_in=True, scalar=True),
             SymVariable("FILENAME", built_in=True, scalar=True),
+            SymVariable("FPAT", built_in=True, scalar=True),
             SymVariable("FNR", built_in=True, scalar=True),
             SymVariable("FS", built_in=True, scalar=True),
             SymVariable("NF", built_in=True, scalar=True),
@@ -2022,6 +2942,7 @@ class AwkPyCompiler:
             SymVariable("OFS", built_in=True, scalar=True),
             SymVariable("ORS", built_in=True, scalar=True),
             SymVariable("RS", built_in=True, scalar=True),
+            SymVariable("RT", built_in=True, scalar=True),
             SymVariable("RLENGTH", built_in=True, scalar=True),
             SymVariable("RSTART", built_in=True, scalar=True),
             SymVariable(
@@ -2052,8 +2973,58 @@ class AwkPyCompiler:
                 python_equivalent="self.awkpy__local_environ",
                 init="0",
             ),
+            SymVariable(
+                "awkpy::csv",
+                built_in=True,
+                scalar=True,
+                python_equivalent="self.awkpy__csv",
+                init="0",
+            ),
+            SymVariable(
+                "awkpy::readahead",
+                built_in=True,
+                scalar=True,
+                python_equivalent="self.awkpy__readahead",
+                init="0",
+            ),
+            SymVariable(
+                "awkpy::readahead_stall",
+                built_in=True,
+                scalar=True,
+                python_equivalent="self.awkpy__readahead_stall",
+                init="0",
+            ),
+            SymVariable(
+                "awkpy::flush",
+                built_in=True,
+                scalar=True,
+                python_equivalent="self.awkpy__flush",
+                init='"auto"',
+            ),
+            SymVariable(
+                "awkpy::mmap",
+                built_in=True,
+                scalar=True,
+                python_equivalent="self.awkpy__mmap",
+                init="0",
+            ),
+            SymVariable(
+                "awkpy::jsonl",
+                built_in=True,
+                scalar=True,
+                python_equivalent="self.awkpy__jsonl",
+                init="0",
+            ),
+            SymVariable(
+                "awkpy::json_fields",
+                built_in=True,
+                scalar=True,
+                python_equivalent="self.awkpy__json_fields",
+                init='""',
+            ),
             SymFunction("awkpy::to_string", python_equivalent="self.awkpy__to_string"),
-            # To implement CONVFMT, ERRNO, FUNCTAB, RS, SUBSEP,SYMTAB
+            SymFunction("awkpy::json", python_equivalent="self.awkpy__json"),
+            # To implement ERRNO, FUNCTAB, RS, SUBSEP,SYMTAB
             Sym("EndOfInput", SymType.END_OF_INPUT),
         ]:
             self.syms[sym.token] = sym
@@ -2080,6 +3051,9 @@ class AwkPyCompiler:
             SymFunction("srand", python_equivalent="random.seed"),
             SymFunction("sin", python_equivalent="math.sin"),
             SymFunction("split", lambda t=[]: self.compile_split_function_call(t)),
+            SymFunction(
+                "patsplit", lambda t=[]: self.compile_patsplit_function_call(t)
+            ),
             SymFunction("sprintf", lambda t=[]: self.compile_sprintf_function_call(t)),
             SymFunction("sqrt", python_equivalent="math.sqrt"),
             SymFunction("sub", lambda t=[]: self.compile_sub_function_call(t)),
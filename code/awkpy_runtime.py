@@ -16,13 +16,26 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from contextlib import contextmanager
 from functools import lru_cache  # would rather use @cache, but not available until 3.9
+from operator import itemgetter
 from subprocess import CompletedProcess, Popen, PIPE, TimeoutExpired
 from collections import defaultdict
 from io import TextIOWrapper
+import codecs
+import csv
+import importlib
+import io
+import json
+import mmap
+import queue
 import sys
 import re
+import signal
+import stat
 import subprocess
+import threading
+import time
 import os
 from pathlib import Path
 from awkpy_common import AwkPyArgParser, AwkPySprintfConversion
@@ -42,6 +55,11 @@ class AwkNextFile(Exception):
     pass
 
 
+class AwkSignal(Exception):
+    """SIGTERM or SIGHUP, raised to unwind the program so its output is
+    written, see AwkpyRuntimeWrapper._catch_signals"""
+
+
 class AwkEmptyVar:
     """
     AWK permits a=x+1 and y=x ".tail" when x has not been initialised.
@@ -78,15 +96,17 @@ class AwkEmptyVar:
         return ~0
 
     def __eq__(self, anotherObj) -> bool:
-        if isinstance(anotherObj, str):
-            return anotherObj == ""
+        if isinstance(anotherObj, AwkNumericString):
+            return anotherObj == self
+        if isinstance(anotherObj, (str, bytes)):
+            return len(anotherObj) == 0
         return int(anotherObj) == 0
 
     def __add__(self, anotherObj):
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __sub__(self, anotherObj):
-        return -anotherObj
+        return -_strnum_number(anotherObj)
 
     def __mul__(self, anotherObj):
         return 0
@@ -104,10 +124,10 @@ class AwkEmptyVar:
         return 0
 
     def __iadd__(self, anotherObj) -> int:
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __isub__(self, anotherObj) -> int:
-        return -anotherObj
+        return -_strnum_number(anotherObj)
 
     def __imul__(self, anotherObj) -> int:
         return 0
@@ -134,10 +154,10 @@ class AwkEmptyVar:
         return 0
 
     def __ixor__(self, anotherObj) -> int:
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __ior__(self, anotherObj) -> int:
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     """ These methods are called to implement the binary arithmetic operations (+, -, *, @, /, //, %,
         divmod(), pow(), **, <<, >>, &, ^, |) with reflected (swapped) operands.
@@ -146,10 +166,10 @@ class AwkEmptyVar:
     """
 
     def __radd__(self, anotherObj):
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __rsub__(self, anotherObj):
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __rmul__(self, anotherObj):
         return 0
@@ -178,19 +198,19 @@ class AwkEmptyVar:
         return 1
 
     def __rlshift__(self, anotherObj):
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __rrshift__(self, anotherObj):
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __rand__(self, anotherObj):
         return 0
 
     def __rxor__(self, anotherObj):
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     def __ror__(self, anotherObj):
-        return anotherObj
+        return _strnum_number(anotherObj)
 
     the_instance = None
 
@@ -203,6 +223,1247 @@ AwkEmptyVar.the_instance = AwkEmptyVar()
 AwkEmptyVarInstance = AwkEmptyVar.instance()
 
 
+# The number at the start of a string, as C's strtod() finds it, and
+# whether that's all there is (the last group)
+_number_prefix = r"[ \t\n]*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)([ \t\n]*\Z)?"
+_number_prefix_regex = re.compile(_number_prefix)
+_number_prefix_bytes_regex = re.compile(_number_prefix.encode("ascii"))
+
+
+def _parse_number(text):
+    """(number, looks numeric) for str or bytes text. The number is that
+    at the start of the text, 0 if there isn't one; an int unless it has
+    a decimal point or exponent"""
+    if text.isdigit() and text.isascii():
+        return int(text[:]), True  # (the slice is plain text, not a strnum)
+    regex = _number_prefix_regex if isinstance(text, str) else _number_prefix_bytes_regex
+    match = regex.match(text)
+    if match is None:
+        return 0, False
+    number, rest = match.groups()
+    try:
+        return int(number), rest is not None
+    except ValueError:  # it has a decimal point or exponent
+        return float(number), rest is not None
+
+
+def _strnum_number(value):
+    """The number of a strnum, other values as they are"""
+    if isinstance(value, AwkNumericString):
+        return value.number()
+    return value
+
+
+def _awk_number(value):
+    """The numeric value of value"""
+    cls = value.__class__
+    if cls is int or cls is float:
+        return value
+    if isinstance(value, AwkNumericString):
+        return value.number()
+    if isinstance(value, (str, bytes)):
+        return _parse_number(value)[0]
+    return value
+
+
+class AwkNumericString:
+    """Arithmetic & comparison for awk's numeric strings ("strnums"):
+    fields, getline variables & -v values. They're text, but are also
+    numbers when used as one. The number is parsed once, when first
+    needed, & kept.
+
+    As in awk, a strnum that looks numeric compares as a number with
+    numbers & other numeric strnums, otherwise comparisons are of text.
+    Mixed into str (AwkStrNum) & bytes (AwkBytesNum).
+    """
+
+    _number = None  # (until parsed)
+    _numeric = None
+
+    def number(self):
+        number = self._number
+        if number is None:
+            self._number, self._numeric = _parse_number(self)
+            number = self._number
+        return number
+
+    def looks_numeric(self) -> bool:
+        numeric = self._numeric
+        if numeric is None:
+            self._number, self._numeric = _parse_number(self)
+            numeric = self._numeric
+        return numeric
+
+    def _numbers(self, other):
+        """(self, other) as numbers if they compare as numbers, else None"""
+        if self.looks_numeric():
+            cls = other.__class__
+            if cls is int or cls is float or cls is bool:
+                return self._number, other
+            if isinstance(other, AwkNumericString):
+                if other.looks_numeric():
+                    return self._number, other._number
+            elif isinstance(other, AwkEmptyVar):
+                return self._number, 0
+        return None
+
+    def _text(self, other):
+        """other as text to compare with self"""
+        if isinstance(other, self._text_type):
+            return other
+        if isinstance(other, AwkEmptyVar):
+            return self[:0]
+        if other.__class__ is float:
+            other = _number_formatter("%.6g")(other)
+        else:
+            other = str(other)
+        return other if self._text_type is str else other.encode("ascii")
+
+    def __eq__(self, other) -> bool:
+        numbers = self._numbers(other)
+        if numbers is None:
+            return self._text_type.__eq__(self, self._text(other))
+        return numbers[0] == numbers[1]
+
+    def __ne__(self, other) -> bool:
+        return not self.__eq__(other)
+
+    def __lt__(self, other) -> bool:
+        numbers = self._numbers(other)
+        if numbers is None:
+            return self._text_type.__lt__(self, self._text(other))
+        return numbers[0] < numbers[1]
+
+    def __le__(self, other) -> bool:
+        numbers = self._numbers(other)
+        if numbers is None:
+            return self._text_type.__le__(self, self._text(other))
+        return numbers[0] <= numbers[1]
+
+    def __gt__(self, other) -> bool:
+        numbers = self._numbers(other)
+        if numbers is None:
+            return self._text_type.__gt__(self, self._text(other))
+        return numbers[0] > numbers[1]
+
+    def __ge__(self, other) -> bool:
+        numbers = self._numbers(other)
+        if numbers is None:
+            return self._text_type.__ge__(self, self._text(other))
+        return numbers[0] >= numbers[1]
+
+    def __bool__(self) -> bool:
+        if self.looks_numeric():
+            return self._number != 0
+        return len(self) > 0
+
+    def __int__(self) -> int:
+        return int(self.number())
+
+    def __float__(self) -> float:
+        return float(self.number())
+
+    def __neg__(self):
+        return -self.number()
+
+    def __pos__(self):
+        return self.number()
+
+    def __abs__(self):
+        return abs(self.number())
+
+    def __add__(self, other):
+        return self.number() + _awk_number(other)
+
+    def __radd__(self, other):
+        return _awk_number(other) + self.number()
+
+    def __sub__(self, other):
+        return self.number() - _awk_number(other)
+
+    def __rsub__(self, other):
+        return _awk_number(other) - self.number()
+
+    def __mul__(self, other):
+        return self.number() * _awk_number(other)
+
+    def __rmul__(self, other):
+        return _awk_number(other) * self.number()
+
+    def __truediv__(self, other):
+        return self.number() / _awk_number(other)
+
+    def __rtruediv__(self, other):
+        return _awk_number(other) / self.number()
+
+    def __floordiv__(self, other):
+        return self.number() // _awk_number(other)
+
+    def __rfloordiv__(self, other):
+        return _awk_number(other) // self.number()
+
+    def __mod__(self, other):
+        return self.number() % _awk_number(other)
+
+    def __rmod__(self, other):
+        return _awk_number(other) % self.number()
+
+    def __pow__(self, other, modulo=None):
+        return self.number() ** _awk_number(other)
+
+    def __rpow__(self, other, modulo=None):
+        return _awk_number(other) ** self.number()
+
+
+class AwkStrNum(AwkNumericString, str):
+    """A numeric string, see AwkNumericString. str() gives the plain text"""
+
+    _text_type = str
+    __hash__ = str.__hash__
+
+    def __str__(self) -> str:
+        return str.__str__(self)
+
+
+class AwkBytesNum(AwkNumericString, bytes):
+    """A numeric string in bytes mode, see AwkNumericString"""
+
+    _text_type = bytes
+    __hash__ = bytes.__hash__
+
+
+def _strnum(value):
+    """value, read as text, as a numeric string"""
+    if value.__class__ is str:
+        return AwkStrNum(value)
+    if value.__class__ is bytes:
+        return AwkBytesNum(value)
+    return value
+
+
+@lru_cache(maxsize=32)
+def _record_separator(rs):
+    """Classify RS, once per value, the way gawk does.
+
+    Returns (regex, window). regex is None for a single character,
+    which is matched literally. window is how far back from the end of
+    the data a match might start that more data could complete: the
+    length of an RS with no special characters, otherwise None as that
+    can't be known, and the search starts again from the record's start.
+    RS is bytes in bytes mode (-b).
+    """
+    if len(rs) == 1:
+        return None, 0
+    if not rs:  # paragraph mode
+        return re.compile(rb"\n\n+" if isinstance(rs, bytes) else r"\n\n+"), 2
+    regex = re.compile(rs)
+    text = rs.decode("latin-1") if isinstance(rs, bytes) else rs
+    if any(c in "\\^$.[]|()*+?{}" for c in text):
+        return regex, None
+    return regex, len(rs)
+
+
+def _split_whitespace(line, maxsplit):
+    """The default FS: runs of whitespace, leading & trailing ignored"""
+    return line.split(None, maxsplit)
+
+
+def _split_characters(line, maxsplit):
+    """An empty FS (gawk): each character is a field"""
+    if isinstance(line, bytes):
+        fields = [line[nr : nr + 1] for nr in range(len(line))]
+    else:
+        fields = list(line)
+    if 0 <= maxsplit < len(fields) - 1:
+        fields[maxsplit:] = [line[maxsplit:]]
+    return fields
+
+
+@lru_cache(maxsize=32)
+def _field_splitter(fs, paragraph=False):
+    """Classify a field separator, once per value, the way POSIX does.
+
+    Returns a function(line, maxsplit) giving the fields of a non empty
+    line, maxsplit working as in str.split. " " is the default, split on
+    whitespace; "" (gawk) splits into characters; any other single
+    character (tab, ",", "|" ...) is literal; a longer string is a
+    regular expression, split with str.split if it has no special
+    characters. fs may also be a compiled regular expression, from
+    split(s, a, /re/). In paragraph mode (RS "") newline separates fields
+    too. fs is bytes in bytes mode (-b).
+    """
+    if isinstance(fs, re.Pattern):
+        regex = fs
+    else:
+        if fs in (" ", b" "):
+            return _split_whitespace
+        if fs in ("", b""):
+            return _split_characters
+        text = fs.decode("latin-1") if isinstance(fs, bytes) else fs
+        if len(text) == 1 or not any(c in "\\^$.[]|()*+?{}" for c in text):
+            if not paragraph:
+
+                def split_literal(line, maxsplit):
+                    return line.split(fs, maxsplit)
+
+                return split_literal
+            fs = re.escape(fs)
+        regex = re.compile(fs)
+    if paragraph:
+        pattern = regex.pattern
+        pattern += b"|\n" if isinstance(pattern, bytes) else "|\n"
+        regex = re.compile(pattern, regex.flags)
+    if regex.groups:  # re.split would return the groups as well
+
+        def split_regex(line, maxsplit):
+            fields = []
+            start = 0
+            for match in regex.finditer(line):
+                if len(fields) == maxsplit:
+                    break
+                fields.append(line[start : match.start()])
+                start = match.end()
+            fields.append(line[start:])
+            return fields
+
+        return split_regex
+    regex_split = regex.split
+
+    def split_regex(line, maxsplit):
+        return regex_split(line, max(maxsplit, 0))
+
+    return split_regex
+
+
+@lru_cache(maxsize=32)
+def _fixed_width_splitter(widths):
+    """Parse FIELDWIDTHS, once per value, into slices of the record.
+
+    widths is a space separated list of field widths, as in gawk: each
+    may be preceded by skip: to skip characters before the field & the
+    last may be * for the rest of the record. Returns a function like
+    _field_splitter's; fields past the end of the record are left out.
+    """
+    if isinstance(widths, bytes):
+        widths = widths.decode("latin-1")
+    slices = []
+    start = 0
+    for width in widths.split():
+        skip, _, width = width.rpartition(":")
+        start += int(skip or 0)
+        if width == "*":
+            slices.append(slice(start, None))
+            break
+        end = start + int(width)
+        slices.append(slice(start, end))
+        start = end
+    last = slices[-1]
+    full_length = last.start if last.stop is None else last.stop
+    if len(slices) > 1:
+        get_fields = itemgetter(*slices)
+    else:
+
+        def get_fields(line):
+            return (line[last],)
+
+    def split_fixed_width(line, maxsplit):
+        """maxsplit is ignored, slicing the extra fields costs little"""
+        if len(line) >= full_length:
+            return list(get_fields(line))
+        return [line[part] for part in slices if part.start < len(line)]
+
+    return split_fixed_width
+
+
+def _pattern_matches(regex, string):
+    """(start, end) of each match of FPAT, as gawk finds them: an empty
+    match straight after a field isn't another field. regex may be the
+    alternatives of FPAT, see _field_pattern"""
+    end = -1
+    if isinstance(regex, re.Pattern):
+        spans = (match.span() for match in regex.finditer(string))
+    else:
+        spans = _longest_matches(regex, string)
+    for start, match_end in spans:
+        if start == match_end and start == end:
+            continue
+        end = match_end
+        yield start, end
+
+
+def _longest_matches(alternatives, string):
+    """(start, end) of each match of any of the alternatives, the
+    longest where several start at the same place, as in gawk"""
+    size = len(string)
+    pending = [None] * len(alternatives)  # the next match of each, once found
+    pos = 0
+    while pos <= size:
+        best = None
+        for nr, regex in enumerate(alternatives):
+            match = pending[nr]
+            if match is None or match.start() < pos:
+                match = pending[nr] = regex.search(string, pos)
+            if match is None:
+                continue
+            span = match.span()
+            if best is None or span[0] < best[0] or span[0] == best[0] and span[1] > best[1]:
+                best = span
+        if best is None:
+            return
+        yield best
+        pos = best[1] if best[1] > best[0] else best[1] + 1
+
+
+def _alternatives(pattern) -> list:
+    """The alternatives at the top level of a regular expression, a|b|c,
+    as their own patterns, or an empty list if there's only one"""
+    text = pattern.decode("latin-1") if isinstance(pattern, bytes) else pattern
+    if text.startswith("(?") and not text.startswith(("(?:", "(?=", "(?!", "(?<", "(?P")):
+        return []  # flags for the whole expression
+    alternatives = []
+    depth = 0
+    start = 0
+    closed = None  # where the first group ends
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char == "\\":
+            pos += 1
+        elif char == "[":  # a class, where ] first is one of its characters
+            pos = text.find("]", pos + (3 if text.startswith("[^", pos) else 2))
+            if pos < 0:
+                return []
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0 and closed is None:
+                closed = pos
+        elif char == "|" and depth == 0:
+            alternatives.append(text[start:pos])
+            start = pos + 1
+        pos += 1
+    if not alternatives:
+        if closed == len(text) - 1 and text[0] == "(":
+            # one group, as regex constants are, (a|b) matches as a|b does
+            inner = text[3:-1] if text.startswith("(?:") else text[1:-1]
+            if not inner.startswith("?"):
+                return _alternatives(inner.encode("latin-1") if isinstance(pattern, bytes) else inner)
+        return []
+    alternatives.append(text[start:])
+    if isinstance(pattern, bytes):
+        return [alternative.encode("latin-1") for alternative in alternatives]
+    return alternatives
+
+
+@lru_cache(maxsize=32)
+def _field_pattern(fpat):
+    """Compile FPAT, once per value. Fields are the text matching it.
+
+    Returns (regex, splitter), splitter being a function like
+    _field_splitter's. Patterns that can't match an empty string are
+    split with a single findall. Python's regular expressions take the
+    first alternative that matches, gawk the longest, so FPAT's top
+    level alternatives are compiled separately & regex is a tuple of
+    them. fpat may be a compiled regular expression, from
+    patsplit(s, a, /re/), & is bytes in bytes mode.
+    """
+    regex = fpat if isinstance(fpat, re.Pattern) else re.compile(fpat)
+    if alternatives := _alternatives(regex.pattern):
+        regex = tuple(re.compile(alternative, regex.flags) for alternative in alternatives)
+
+        def split_pattern(line, maxsplit):
+            return [line[start:end] for start, end in _pattern_matches(regex, line)]
+
+    elif not regex.groups and regex.match(regex.pattern[:0]) is None:
+
+        def split_pattern(line, maxsplit):
+            return regex.findall(line)
+
+    else:
+
+        def split_pattern(line, maxsplit):
+            return [line[start:end] for start, end in _pattern_matches(regex, line)]
+
+    return regex, split_pattern
+
+
+def _csv_records(lines, quote):
+    """Join lines into CSV records (awkpy::csv): a newline inside a
+    quoted field is part of the field, not the end of the record"""
+    for line in lines:
+        while line.count(quote) % 2:
+            more = next(lines, None)
+            if more is None:
+                break
+            line += more
+        yield line
+
+
+class _CsvFeed:
+    """The iterator a csv.reader reads from, one record at a time"""
+
+    __slots__ = ("line",)
+
+    def __init__(self):
+        self.line = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.line
+        if line is None:
+            raise StopIteration
+        self.line = None
+        return line
+
+
+@lru_cache(maxsize=8)
+def _csv_splitter(fs):
+    """Split CSV records (awkpy::csv) with the csv module's parser.
+
+    The delimiter is FS if it's a single character other than space,
+    so -F '\\t' reads quoted TSV, otherwise a comma. Returns a function
+    like _field_splitter's. Bytes are parsed as latin-1, which
+    round trips every byte.
+    """
+    delimiter = fs.decode("latin-1") if isinstance(fs, bytes) else fs
+    if delimiter[:1] == "\\":  # -F '\t'
+        delimiter = codecs.decode(delimiter, "unicode_escape")
+    if len(delimiter) != 1 or delimiter == " ":
+        delimiter = ","
+    feed = _CsvFeed()
+    reader = csv.reader(feed, delimiter=delimiter)
+    if isinstance(fs, bytes):
+
+        def split_csv_bytes(line, maxsplit):
+            feed.line = line.decode("latin-1")
+            return [field.encode("latin-1") for field in next(reader)]
+
+        return split_csv_bytes
+
+    def split_csv(line, maxsplit):
+        feed.line = line
+        return next(reader)
+
+    return split_csv
+
+
+@lru_cache(maxsize=8)
+def _csv_writer(delimiter, lineterminator):
+    """A csv.writer & the buffer it writes to, for print with --csv"""
+    buffer = io.StringIO()
+    return csv.writer(buffer, delimiter=delimiter, lineterminator=lineterminator), buffer
+
+
+_json_decode = json.JSONDecoder().raw_decode  # skips the checks of json.loads
+
+
+@lru_cache(maxsize=1)
+def _json_record(line):
+    """A JSON Lines record (awkpy::jsonl) decoded, once however often its
+    fields are used. None if it isn't valid JSON"""
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", "surrogateescape")
+    try:
+        return _json_decode(line)[0]
+    except ValueError:  # includes leading white space
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+
+def _json_text(value, bytes_mode=False):
+    """A JSON value as an awk string: true is 1, false 0, null empty &
+    objects & arrays are compact JSON"""
+    if isinstance(value, str):
+        text = value
+    elif value is None:
+        text = ""
+    elif isinstance(value, bool):
+        text = "1" if value else "0"
+    else:
+        text = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return text.encode("utf-8", "surrogateescape") if bytes_mode else text
+
+
+@lru_cache(maxsize=8)
+def _json_splitter(keys, bytes_mode=False):
+    """Fields of JSON Lines records (awkpy::jsonl).
+
+    keys is awkpy::json_fields, the space separated names of the members
+    that are $1, $2 ...; when empty the fields are all the members'
+    values in order. Returns a function like _field_splitter's.
+    """
+    if isinstance(keys, bytes):
+        keys = keys.decode("utf-8", "surrogateescape")
+    keys = tuple(keys.split())
+
+    def split_json(line, maxsplit):
+        record = _json_record(line)
+        if not isinstance(record, dict):
+            return []
+        if keys:
+            return [_json_text(record.get(key), bytes_mode) for key in keys]
+        return [_json_text(value, bytes_mode) for value in record.values()]
+
+    return split_json
+
+
+# How compressed files start, and the module that reads them
+_compressed_signatures = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "lzma"),
+)
+
+
+_sprintf_format_regex = re.compile(
+    r"([\\%]%)|([{}])|"
+    r"(%([0-9]*\$)?([-+ 0'#])?([1-9*][0-9]*)?([.][0-9*]+)?([aAcdeEfFgGiosuxX]))"
+)
+_sprintf_replacements = {r"\%": "%", "%%": "%", "{": "{{", "}": "}}"}
+
+
+def _star_argument(value):
+    """The width or precision given by * in a sprintf format"""
+    return str(int(value))
+
+
+@lru_cache(maxsize=64)
+def _sprintf_format(awk):
+    """A sprintf format, parsed once into the format method of a str.format
+    template & the conversions of the arguments it formats, each (index
+    of the sprintf argument, conversion function). Widths & precisions
+    given by * are nested fields, so every argument is in a fixed place.
+    """
+    template = []
+    conversions = []
+    next_argument = 0
+    end = 0
+    for match in _sprintf_format_regex.finditer(awk):
+        template.append(awk[end : match.start()])
+        end = match.end()
+        if replacement := _sprintf_replacements.get(match.group(0)):
+            template.append(replacement)
+            continue
+        parameter, flags, width, precision, pftype = match.group(4, 5, 6, 7, 8)
+        parmtype = AwkPySprintfConversion.all_conversions[pftype]
+        # width & precision come before the value when they are arguments
+        precision = parmtype.default_precision if precision is None else precision
+        spec = ""
+        if width is not None or precision != "":
+            if width is None:
+                width = "0"
+            elif width == "*":
+                width = "{%d}" % len(conversions)
+                conversions.append((next_argument, _star_argument))
+                next_argument += 1
+            if precision != "":
+                precision = precision.lstrip(".")
+                if precision == "*":
+                    precision = "{%d}" % len(conversions)
+                    conversions.append((next_argument, _star_argument))
+                    next_argument += 1
+                width += "." + precision
+            align = "<" if flags is not None and "-" in flags else ">"
+            spec = ":" + align + width + parmtype.format_sfx
+        if parameter is None:
+            parameter_nr = next_argument
+            next_argument += 1
+        else:
+            parameter_nr = int(parameter[0:-1]) - 1
+        template.append("{%d%s}" % (len(conversions), spec))
+        conversions.append((parameter_nr, parmtype.dynamic))
+    template.append(awk[end:])
+    return "".join(template).format, conversions
+
+
+# A single conversion of a number Python's % operator formats as C does
+_number_format_regex = re.compile(r"^[^%\\{}]*%[-+ #0]*[0-9]*(\.[0-9]*)?[dieEfFgG][^%\\{}]*$")
+_integral_limit = 2**63
+
+
+@lru_cache(maxsize=16)
+def _number_formatter(fmt):
+    """OFMT or CONVFMT as a function giving the text of a float, compiled
+    once per assignment. As in gawk, integral values within the range of
+    a C long are shown as integers, whatever the format. Formats that
+    aren't one plain conversion are passed to sprintf."""
+    if isinstance(fmt, bytes):
+        fmt = fmt.decode("latin-1")
+    else:
+        fmt = str(fmt)  # not a strnum, where % is arithmetic
+    if _number_format_regex.match(fmt):
+
+        def format_number(value):
+            if value.is_integer() and -_integral_limit < value < _integral_limit:
+                return str(int(value))
+            return fmt % value
+
+    else:
+        template, conversions = _sprintf_format(fmt)
+
+        def format_number(value):
+            if value.is_integer() and -_integral_limit < value < _integral_limit:
+                return str(int(value))
+            return template(*[convert((value,)[nr]) for nr, convert in conversions])
+
+    return format_number
+
+
+class AwkReadAheadStream(io.RawIOBase):
+    """Reads a binary stream ahead, in a thread (awkpy::readahead).
+
+    The thread keeps a queue of up to depth blocks filled, so waiting
+    for the disk, a pipe or decompression overlaps with running the awk
+    program; all of these release the GIL. The time spent waiting for a
+    block is added to awkpy::readahead_stall when the stream is closed.
+    Closing stops the thread, not the stream it reads.
+    """
+
+    def __init__(self, runtime, stream, depth, blocksize=1024 * 1024):
+        super().__init__()
+        self.runtime = runtime
+        self.block = memoryview(b"")
+        self.at_end = False
+        self.stall = 0.0
+        self.blocks = queue.Queue(depth)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self.read_ahead, args=(stream, blocksize), daemon=True
+        )
+        self.thread.start()
+
+    def read_ahead(self, stream, blocksize):
+        """The thread: blocks of the stream, b"" at the end of it"""
+        read = getattr(stream, "read1", stream.read)  # don't wait to fill a block
+        try:
+            while not self.stopping.is_set():
+                block = read(blocksize)
+                self.put(block)
+                if not block:
+                    return
+        except Exception as error:  # raised again by readinto
+            self.put(error)
+
+    def put(self, item):
+        while not self.stopping.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        block = self.block
+        if not block:
+            if self.at_end:
+                return 0
+            try:
+                block = self.blocks.get_nowait()
+            except queue.Empty:
+                started = time.perf_counter()
+                block = self.blocks.get()
+                self.stall += time.perf_counter() - started
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.at_end = True
+                return 0
+            block = memoryview(block)
+        size = min(len(buffer), len(block))
+        buffer[:size] = block[:size]
+        self.block = block[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopping.set()
+            try:  # make room for anything the thread is waiting to put
+                while True:
+                    self.blocks.get_nowait()
+            except queue.Empty:
+                pass
+            self.thread.join()
+            self.runtime.awkpy__readahead_stall += self.stall
+        super().close()
+
+
+@contextmanager
+def _open_input(runtime, name, encoding=None):
+    """Open an input file, "-" being stdin, in binary or as text if
+    encoding is given. Gives (stream, plain), plain being False if the
+    stream isn't the file itself, so can't be memory mapped.
+
+    Files compressed by gzip, bzip2 or xz, recognised by their first
+    bytes rather than their names, are decompressed as they are read.
+    They, & everything else, are read ahead in a thread if
+    awkpy::readahead is set. stdin isn't closed.
+    """
+    file = sys.stdin.buffer if name == "-" else open(name, "rb")
+    to_close = [] if name == "-" else [file]  # closed last first
+    try:
+        stream = file
+        magic = file.peek(6)[:6] if hasattr(file, "peek") else b""
+        for signature, module in _compressed_signatures:
+            if magic.startswith(signature):
+                stream = importlib.import_module(module).open(file)
+                to_close.append(stream)
+                break
+        depth = int(runtime.awkpy__readahead)
+        if depth > 0:
+            stream = io.BufferedReader(AwkReadAheadStream(runtime, stream, depth))
+            to_close.append(stream)
+        plain = stream is file and name != "-"
+        if encoding is None:
+            yield stream, plain
+        else:
+            text = io.TextIOWrapper(stream, encoding=encoding)
+            try:
+                yield text, False
+            finally:
+                if not text.closed:  # yield from closes it when stopped early
+                    text.detach()  # leaving the streams it reads to be closed below
+    finally:
+        for stream in reversed(to_close):
+            stream.close()
+
+
+class AwkRecordReader:
+    """Splits an input stream into records separated by RS, setting RT.
+
+    Fixed size blocks are read into a buffer that is reused for the whole
+    stream and decoded incrementally. Anything after the last complete
+    record is carried over to the next block, so memory use is bounded by
+    the block size plus the longest record.
+
+    RS is a literal if it is a single character, a regular expression if
+    it is longer, or paragraph mode (records separated by blank lines)
+    if it is empty.
+
+    With encoding None (bytes mode) blocks are not decoded and records
+    are bytes.
+    """
+
+    min_blocksize = 64 * 1024
+    max_blocksize = 1024 * 1024
+
+    def __init__(self, runtime, stream, encoding="utf-8"):
+        self.runtime = runtime
+        self.stream = stream
+        self.encoding = encoding
+        self.blocksize = self.choose_blocksize(stream, int(runtime.awkpy__blocksize))
+
+    @classmethod
+    def choose_blocksize(cls, stream, requested: int) -> int:
+        """awkpy::blocksize if set, otherwise a multiple of the
+        file system's preferred size, shrunk to fit small files"""
+        if requested > 0:
+            return requested
+        try:
+            file_stat = os.fstat(stream.fileno())
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return cls.min_blocksize
+        preferred = getattr(file_stat, "st_blksize", 0) or 4096
+        blocksize = min(max(cls.min_blocksize, preferred * 16), cls.max_blocksize)
+        if stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0:
+            # one read to get the whole file and one to see the end of it
+            blocksize = min(blocksize, file_stat.st_size + 1)
+        return blocksize
+
+    def blocks(self):
+        """Decoded blocks of the stream"""
+        stream = self.stream
+        readinto = getattr(stream, "readinto", None)
+        if readinto is None:  # text stream, such as a StringIO standing in for stdin
+            while block := stream.read(self.blocksize):
+                yield block if self.encoding else block.encode("utf-8")
+            return
+        buffer = bytearray(self.blocksize)
+        view = memoryview(buffer)
+        if self.encoding is None:
+            while size := readinto(view):
+                yield bytes(view[:size])
+            return
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        while size := readinto(view):
+            yield decoder.decode(view[:size])
+        yield decoder.decode(b"", True)
+
+    def __iter__(self):
+        runtime = self.runtime
+        blocks = self.blocks()
+        newline = "\n" if self.encoding else b"\n"
+        pending = newline[:0]  # data not yet returned as records, starting at pos
+        pos = 0
+        scan_from = 0  # pending before this can't start a separator
+        at_eof = False
+        rs = runtime.RS
+        regex, window = _record_separator(rs)
+        paragraph_mode = not rs
+        skip_newlines = True
+        while True:
+            if regex is None:
+                end = pending.rfind(rs, scan_from)
+                if end >= 0:
+                    records = iter(pending[pos:end].split(rs))
+                    pending = pending[end + 1 :]
+                    pos = scan_from = 0
+                    runtime.RT = rs
+                    for record in records:
+                        yield record
+                        if runtime.RS is not rs:
+                            # RS changed, put back the unread records to be split again
+                            rest = list(records)
+                            if rest:
+                                pending = rs.join(rest) + rs + pending
+                            break
+                    if runtime.RS is not rs:
+                        rs = runtime.RS
+                        regex, window = _record_separator(rs)
+                        paragraph_mode = not rs
+                    continue
+                scan_from = len(pending)
+            else:
+                if paragraph_mode and skip_newlines:
+                    # newlines before the first record are ignored
+                    pos = scan_from = len(pending) - len(pending.lstrip(newline))
+                    skip_newlines = pos == len(pending)
+                match = regex.search(pending, scan_from)
+                while match and match.end() == match.start():  # ignore empty matches
+                    match = regex.search(pending, match.end() + 1)
+                if match and (at_eof or match.end() < len(pending)):
+                    runtime.RT = match.group()
+                    record = pending[pos : match.start()]
+                    pos = scan_from = match.end()
+                    yield record
+                    if runtime.RS is not rs:
+                        rs = runtime.RS
+                        regex, window = _record_separator(rs)
+                        paragraph_mode = not rs
+                    continue
+                if match:  # more data might extend the match
+                    scan_from = match.start()
+                elif window is None:
+                    scan_from = pos
+                else:
+                    scan_from = max(pos, len(pending) - window + 1)
+            if at_eof:
+                break
+            block = next(blocks, None)
+            if block is None:
+                at_eof = True
+                continue
+            if pos > 0:
+                pending = pending[pos:]
+                scan_from -= pos
+                pos = 0
+            pending += block
+        if pos < len(pending):
+            record = pending[pos:]
+            runtime.RT = record[:0]
+            if paragraph_mode:
+                stripped = record.rstrip(newline)
+                runtime.RT = record[len(stripped) :]
+                record = stripped
+            yield record
+
+
+@lru_cache(maxsize=32)
+def _record_separator_bytes(rs, encoding: str):
+    """As _record_separator, for searching undecoded data"""
+    if len(rs) == 1:
+        return None
+    if not rs:  # paragraph mode
+        return re.compile(rb"\n\n+")
+    return re.compile(rs if isinstance(rs, bytes) else rs.encode(encoding))
+
+
+class AwkMmapRecordReader(AwkRecordReader):
+    """Finds records in a memory mapped file, awkpy::mmap=1.
+
+    The file is searched in place, without being copied into Python,
+    and each record is decoded only when the program asks for it, or
+    not at all in bytes mode.
+    Only regular files can be mapped, other input should use
+    AwkRecordReader.
+    """
+
+    @staticmethod
+    def can_map(stream) -> bool:
+        try:
+            file_stat = os.fstat(stream.fileno())
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return False
+        return stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > 0
+
+    @staticmethod
+    def can_search(rs, encoding) -> bool:
+        """Whether records separated by rs can be found in the undecoded
+        file. A regex containing a multibyte character, "[é;]" say,
+        would match part of one, so has to be searched for in text"""
+        regex = _record_separator_bytes(rs, encoding)
+        return encoding is None or regex is None or regex.pattern.isascii()
+
+    def __iter__(self):
+        runtime = self.runtime
+        encoding = self.encoding
+        with mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            yield from self._records(runtime, encoding, mapped)
+
+    def _records(self, runtime, encoding, mapped):
+        size = len(mapped)
+        pos = 0
+        rs = runtime.RS
+        if encoding is None:  # bytes mode
+            decode = bytes
+            encode = bytes
+        else:
+            decode = lambda data: data.decode(encoding)
+            encode = lambda text: text.encode(encoding)
+        regex = _record_separator_bytes(rs, encoding)
+        sep = encode(rs)
+        if not rs:  # paragraph mode ignores newlines before the first record
+            while pos < size and mapped[pos] == 10:
+                pos += 1
+        while pos < size:
+            if regex is None:
+                end = mapped.find(sep, pos)
+                if end < 0:
+                    break
+                next_pos = end + len(sep)
+                runtime.RT = rs
+            else:
+                match = regex.search(mapped, pos)
+                while match and match.end() == match.start():  # ignore empty matches
+                    match = regex.search(mapped, match.end() + 1)
+                if not match:
+                    break
+                end, next_pos = match.span()
+                runtime.RT = decode(mapped[end:next_pos])
+            yield decode(mapped[pos:end])
+            pos = next_pos
+            if runtime.RS is not rs:
+                rs = runtime.RS
+                if not self.can_search(rs, encoding):
+                    # the rest of the file is decoded & searched as text
+                    rest = io.BytesIO(mapped[pos:])
+                    yield from AwkRecordReader(runtime, rest, encoding)
+                    return
+                regex = _record_separator_bytes(rs, encoding)
+                sep = encode(rs)
+        if pos < size:
+            record = decode(mapped[pos:size])
+            runtime.RT = record[:0]
+            if not rs:
+                stripped = record.rstrip(runtime._newline)
+                runtime.RT = record[len(stripped) :]
+                record = stripped
+            yield record
+
+
+class AwkOutputBuffer:
+    """Output to a file, pipe or stdout, collected & written in large
+    chunks rather than a write for every value printed.
+
+    When it's written depends on the policy, awkpy::flush: "block" when
+    blocksize characters (bytes in bytes mode) are waiting, "line" after
+    each newline, "record" after every print & printf. "auto" is "line"
+    for terminals, "block" otherwise. Except in block mode, the stream
+    is flushed too, so the output is seen at once.
+    """
+
+    blocksize = 64 * 1024
+
+    def __init__(self, stream, newline, policy="auto", interactive=None):
+        self.stream = stream
+        self.newline = newline
+        self.empty = newline[:0]
+        self.pending = []
+        self.size = 0
+        if interactive is None:
+            try:
+                interactive = stream.isatty()
+            except (AttributeError, ValueError):  # no file, or already closed
+                interactive = False
+        self.interactive = interactive
+        self.set_policy(policy)
+
+    def set_policy(self, policy):
+        if isinstance(policy, bytes):
+            policy = policy.decode("ascii", "replace")
+        if policy == "auto":
+            policy = "line" if self.interactive else "block"
+        if policy not in ("block", "line", "record"):
+            raise ValueError('awkpy::flush must be "auto", "block", "line" or "record"')
+        self.limit = self.blocksize if policy == "block" else 0
+        self.by_line = policy == "line"
+        if self.limit == 0:
+            self.flush()
+
+    def write(self, data):
+        self.pending.append(data)
+        self.size += len(data)
+        if self.size >= self.limit and (not self.by_line or self.newline in data):
+            if self.limit:
+                self.write_pending()
+            else:
+                self.flush()
+
+    def write_pending(self):
+        if self.pending:
+            data = self.empty.join(self.pending)
+            self.pending.clear()
+            self.size = 0
+            self.stream.write(data)
+
+    def flush(self):
+        self.write_pending()
+        self.stream.flush()
+
+
+class AwkRecord:
+    """The current record: $0 and its fields, $1..$NF.
+
+    One instance is reused for every record. $0 is kept as read and is
+    only split, into a single list, when a field or NF is first used.
+    Reading a field beyond NF gives the empty value without adding it.
+
+    Assigning a field or NF only marks $0 as stale, it is rebuilt with
+    OFS when next read ($0 is self._record[0] in programs that assign
+    fields, plain self._record.line otherwise).
+
+    Fields are made numeric strings (AwkStrNum) when first read with
+    self._record[nr], so their number is only parsed once. print and
+    concatenation use self._record.text(nr), which leaves them as read.
+    """
+
+    __slots__ = ("runtime", "line", "FS", "splitter", "fields", "nf", "stale")
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self.line = ""
+        self.FS = " "  # None when FIELDWIDTHS or FPAT is in use
+        self.splitter = _split_whitespace  # FS classified, see _field_splitter
+        self.fields = []  # $1..$NF, None until split
+        self.nf = 0
+        self.stale = False  # line needs rebuilding from fields
+
+    def split(self) -> list:
+        """Split $0 into $1..$NF, or $1..$_max_field when the compiler
+        has found that's all the program can see"""
+        runtime = self.runtime
+        line = self.line
+        max_field = runtime._max_field or -1
+        if not line:
+            fields = []
+        elif runtime.RS or self.FS is None:
+            fields = self.splitter(line, max_field)
+        else:  # paragraph mode, newline also separates fields
+            fields = _field_splitter(self.FS, True)(line, max_field)
+        if len(fields) > max_field > 0:
+            del fields[max_field:]  # the unsplit rest, or the rest if maxsplit is ignored
+        self.fields = fields
+        self.nf = len(fields)
+        return fields
+
+    def __getitem__(self, nr):
+        fields = self.fields
+        if fields is None:
+            fields = self.split()
+        if 0 < nr <= len(fields):
+            field = fields[nr - 1]
+            cls = field.__class__
+            if cls is str:  # made a strnum when first used
+                field = fields[nr - 1] = AwkStrNum(field)
+            elif cls is bytes:
+                field = fields[nr - 1] = AwkBytesNum(field)
+            return field
+        if nr == 0:
+            if self.stale:
+                self.rebuild()
+            return self.line
+        return AwkEmptyVarInstance
+
+    def text(self, nr):
+        """$nr as a string, without making it a strnum, for print &
+        concatenation"""
+        fields = self.fields
+        if fields is None:
+            fields = self.split()
+        if 0 < nr <= len(fields):
+            field = fields[nr - 1]
+            cls = field.__class__
+            if cls is str or cls is bytes:
+                return field
+            if self.runtime._bytes_mode:
+                return self.runtime._bytes_value(field)
+            return self.runtime._string_value(field)
+        if nr == 0:
+            if self.stale:
+                self.rebuild()
+            return self.line
+        return self.line[:0]
+
+    def __setitem__(self, nr, value):
+        """Set $nr. $0 is left to be rebuilt when it's next used"""
+        if nr == 0:
+            self.runtime._set_dollar_fields(value)
+            return
+        fields = self.fields
+        if fields is None:
+            fields = self.split()
+        if nr > len(fields):
+            self.resize(nr)
+        fields[nr - 1] = value
+        self.stale = True
+
+    def __len__(self) -> int:
+        """NF"""
+        if self.fields is None:
+            self.split()
+        return self.nf
+
+    def resize(self, nf: int):
+        """Assign NF, dropping fields or adding empty ones"""
+        fields = self.fields
+        if fields is None:
+            fields = self.split()
+        if nf < len(fields):
+            del fields[nf:]
+        else:
+            fields.extend([self.line[:0]] * (nf - len(fields)))
+        self.nf = nf
+        self.stale = True
+
+    def rebuild(self):
+        """$0 from the fields, separated by OFS"""
+        runtime = self.runtime
+        if runtime.awkpy__csv != 0:  # quoted, so it reads back as the same fields
+            # (a newline ending the row, so that fields containing one are quoted)
+            self.line = runtime._csv_row(self.fields, runtime.OFS, runtime._newline)[:-1]
+            self.stale = False
+            return
+        try:
+            self.line = runtime.OFS.join(self.fields)
+        except TypeError:  # numbers have been assigned to fields
+            if runtime._bytes_mode:
+                to_string = runtime.awkpy__to_bytes
+            else:
+                to_string = runtime.awkpy__to_string
+            fields = [to_string(field) for field in self.fields]
+            self.line = runtime.OFS.join(fields)
+        self.stale = False
+
+
 class AwkpyRuntimeVarOwner:
     global AwkEmptyVarInstance
     """A class to support translations of AWK variable manipulations
@@ -295,7 +1556,7 @@ class AwkpyRuntimeVarOwner:
         if start < 1:
             start = 1
         elif start > len(string):
-            return ""
+            return string[:0]
         start -= 1  # AWK uses 1 based, Python 0 based
         if length is None:
             return string[start:]
@@ -317,6 +1578,9 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
     Translated programs inherit from this class"""
 
     _ans = 0
+    # variables the compiler found are only ever strings, which var=val
+    # on the command line doesn't make numeric strings
+    _string_variables = frozenset()
 
     def awkpy__BEGIN(self):
         """
@@ -339,6 +1603,20 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         """
         pass
 
+    def awkpy__RECORDS(self, records):
+        """
+        This method runs the main loop for each of a file's records.
+        The compiler generates one with the main loop inlined.
+        """
+        for line in records:
+            self._set_dollar_fields(line)
+            self.NR += 1
+            self.FNR += 1
+            try:
+                self.awkpy__MAINLOOP()
+            except AwkNext:
+                pass
+
     def awkpy__ENDFILE(self):
         """
         This method is run after each file's input ends.
@@ -354,11 +1632,74 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         pass
 
     @lru_cache
-    def _dynamic_regex(self, regex: str):
-        if regex[0] != "(":
+    def _dynamic_regex(self, regex):
+        if self._bytes_mode:
+            regex = self.awkpy__to_bytes(regex)
+            if regex[:1] != b"(":
+                regex = b"(" + regex + b")"
+        elif regex[0] != "(":
             regex = f"({regex})"
         return re.compile(regex)
 
+    def _split(self, string, fs) -> list:
+        """split(string, array, fs): fs is classified as FS is"""
+        if not string:
+            return []
+        if not isinstance(fs, (str, bytes, re.Pattern)):
+            fs = self.awkpy__to_bytes(fs) if self._bytes_mode else str(fs)
+        return _field_splitter(fs)(string, -1)
+
+    def awkpy__json(self, *keys):
+        """awkpy::json(key ...), a member of the current JSON Lines record,
+        further keys for members of objects or (from 1) array elements"""
+        value = _json_record(self._record.line)
+        for key in keys:
+            if isinstance(key, bytes):
+                key = key.decode("utf-8", "surrogateescape")
+            if isinstance(value, dict):
+                value = value.get(str(key))
+            elif isinstance(value, list) and 0 < int(key) <= len(value):
+                value = value[int(key) - 1]
+            else:
+                value = None
+                break
+        return _json_text(value, self._bytes_mode)
+
+    def _csv_row(self, values, sep, end):
+        """values as a CSV row, quoted as csv.writer does (--csv)"""
+        if self._bytes_mode:
+            to_bytes = self.awkpy__to_bytes
+            values = [to_bytes(value).decode("latin-1") for value in values]
+            sep = sep.decode("latin-1")
+            end = end.decode("latin-1")
+        else:
+            to_string = self.awkpy__to_string
+            values = [to_string(value) for value in values]
+        writer, buffer = _csv_writer(sep, end)
+        writer.writerow(values)
+        row = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return row.encode("latin-1") if self._bytes_mode else row
+
+    def _patsplit(self, string, fpat=None):
+        """patsplit(string, array, fpat, seps): returns the fields & the
+        separators, seps[0] being any text before the first field"""
+        if fpat is None:
+            fpat = self._FPAT
+        elif not isinstance(fpat, (str, bytes, re.Pattern)):
+            fpat = self.awkpy__to_bytes(fpat) if self._bytes_mode else str(fpat)
+        regex = _field_pattern(fpat)[0]
+        fields = []
+        seps = []
+        end = 0
+        for start, next_end in _pattern_matches(regex, string):
+            seps.append(string[end:start])
+            fields.append(string[start:next_end])
+            end = next_end
+        seps.append(string[end:])
+        return fields, seps
+
     def _match(self, haystack, regex_str):
         regex = self._dynamic_regex(regex_str)
         match = regex.search(haystack)
@@ -370,8 +1711,10 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         self.RSTART = self.RLENGTH = -1
         return -1
 
-    def _dynamic_replacement(self, repl: str):
+    def _dynamic_replacement(self, repl):
         """Replacement strings in AWK use '&' where Python uses '\1'."""
+        if self._bytes_mode:
+            repl = self.awkpy__to_bytes(repl).decode("latin-1")
         # POSIX specifies one \, gawk uses 2 ???
         # I guess this will eventually be reported as a bug
         # meanwhile I'll just brute force it
@@ -379,6 +1722,8 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         repl = repl.replace(r"\&", chr(1))
         repl = repl.replace("&", r"\1")
         repl = repl.replace(chr(1), r"&")
+        if self._bytes_mode:
+            return repl.encode("latin-1")
         return repl
 
     def _system(self, commandline, capture_output=""):
@@ -392,22 +1737,26 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
             # ValueError: env cannot contain 'PATH' and b'PATH' keys
             env = {k: v for k, v in self.ENVIRON.items()}
             opts["env"] = env
+        if not self._bytes_mode:
+            opts["encoding"] = "utf-8"
+        self.awkpy__fflush()  # output so far comes before the command's
         try:
             completedprocess: CompletedProcess = subprocess.run(
-                commandline.split(), encoding="utf-8", **opts
+                commandline.split(), **opts
             )
         except FileNotFoundError:
             return -1
         if capture_output != "":
+            newline = self._newline
             stdout = (
-                ""
-                if completedprocess.stdout == ""
-                else completedprocess.stdout.strip("\n") + "\n"
+                newline[:0]
+                if not completedprocess.stdout
+                else completedprocess.stdout.strip(newline) + newline
             )
             stderr = (
-                ""
-                if completedprocess.stderr == ""
-                else completedprocess.stderr.strip("\n") + "\n"
+                newline[:0]
+                if not completedprocess.stderr
+                else completedprocess.stderr.strip(newline) + newline
             )
             self.__setattr__(capture_output, stdout + stderr)
         return completedprocess.returncode
@@ -418,12 +1767,20 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
             self.name = name
             self.mode = mode
             self.rc = 1  # success
+            self.output = None  # an AwkOutputBuffer, once open for output
 
         def open(self):
             pass
 
+        def open_output(self, stream, interactive=None):
+            runtime = self.runtime
+            self.output = AwkOutputBuffer(
+                stream, runtime._newline, runtime._flush_policy, interactive
+            )
+
         def fflush(self):
-            pass
+            if self.output:
+                self.output.flush()
 
         def close(self):
             return 0
@@ -431,8 +1788,23 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         def get(self):
             return None
 
-        def print(self, *n, **kw):
-            return None
+        def print(self, *n, sep=" ", end="\n"):
+            try:
+                data = sep.join(n) + end
+            except TypeError:  # a number the compiler didn't convert, or OFS
+                if self.runtime._bytes_mode:
+                    to_string = self.runtime.awkpy__to_bytes
+                else:
+                    to_string = self.runtime.awkpy__to_string
+                data = to_string(sep).join(map(to_string, n)) + to_string(end)
+            self.output.write(data)
+
+        def print_csv(self, *n, sep=",", end="\n"):
+            """print, quoting values as csv.writer does (--csv)"""
+            self.output.write(self.runtime._csv_row(n, sep, end))
+
+        def write(self, data):
+            self.output.write(data)
 
         def get_into_dollar_fields(self):
             self.runtime._set_dollar_fields(self.get())
@@ -443,7 +1815,7 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
             return self.rc
 
         def get_into_variable(self, var):
-            self.runtime.__setattr__(var, self.get())
+            self.runtime.__setattr__(var, _strnum(self.get()))
             return self.rc
 
     class awkpy__StdInOutWrapper(awkpy__FileWrapper):
@@ -452,6 +1824,7 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         def __init__(self, runtime):
             super().__init__(runtime, "", "rw")
             self.file_handle = None
+            self.open_output(sys.stdout.buffer if runtime._bytes_mode else sys.stdout)
 
         def open(self):
             pass  # always open
@@ -459,23 +1832,21 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         def get(self):
             try:
                 ans = self.runtime._current_input.__next__()
-                if ans == "":
+                if not ans:
                     self.rc = 0
                 else:
-                    ans = ans.strip("\n")
+                    ans = ans.strip(self.runtime._newline)
                     self.rc = 1
             except StopIteration:
-                ans = ""
+                ans = self.runtime._newline[:0]
                 self.rc = 0
             self.runtime.NR += 1
             self.runtime.FNR += 1
             return ans
 
-        def print(self, *n, **kw):
-            print(*n, **kw)
-
-        def fflush(self):
-            sys.stdout.flush()
+        def close(self):
+            self.output.flush()  # but stdout stays open
+            return 0
 
     class awkpy__FileIOWrapper(awkpy__FileWrapper):
         def __init__(self, runtime, name: str, mode: str):
@@ -483,9 +1854,18 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
             self.file_handle = None
 
         def open(self):
-            self.file_handle = open(self.name, self.mode, encoding="utf-8")
+            if self.runtime._bytes_mode:
+                self.file_handle = open(self.name, self.mode + "b")
+            else:
+                self.file_handle = open(self.name, self.mode, encoding="utf-8")
+            if "w" in self.mode or "a" in self.mode:
+                # gawk doesn't buffer /dev/stderr
+                interactive = True if self.name == "/dev/stderr" else None
+                self.open_output(self.file_handle, interactive)
 
         def close(self):
+            if self.output:
+                self.output.flush()
             self.file_handle.close()
             del self.file_handle
 
@@ -494,14 +1874,6 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
             self.rc = 0 if len(ans) == 0 else 1
             return ans.rstrip()
 
-        def print(self, *n, **kw):
-            kw["file"] = self.file_handle
-            print(*n, **kw)
-
-        def fflush(self):
-            if "w" in self.mode or "a" in self.mode:
-                self.file_handle.flush()
-
     class awkpy__PipeIOWrapper(awkpy__FileWrapper):
         def __init__(self, runtime, name: str, mode: str, stdin=None, stdout=None):
             super().__init__(runtime, name, mode)
@@ -521,23 +1893,21 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
                 env = {k: v for k, v in self.runtime.ENVIRON.items()}
                 opts["env"] = env
 
-            self.popen = subprocess.Popen(self.name.split(), encoding="utf-8", **opts)
+            if not self.runtime._bytes_mode:
+                opts["encoding"] = "utf-8"
+            self.runtime.awkpy__fflush()  # so the command's output follows ours
+            self.popen = subprocess.Popen(self.name.split(), **opts)
+            if self.has_stdin:
+                self.open_output(self.popen.stdin)
 
         def get(self):
             ans = self.popen.stdout.readline()
             self.rc = 0 if len(ans) == 0 else 1
             return ans.rstrip()
 
-        def print(self, *n, **kw):
-            kw["file"] = self.popen.stdin
-            print(*n, **kw)
-
-        def fflush(self):
-            if self.popen.stdin:
-                self.popen.stdin.flush()
-
         def close(self):
             if self.popen.stdin:
+                self.output.flush()
                 self.popen.stdin.close()
             if self.runtime.awkpy__wait_for_pipe_close != 0:
                 try:
@@ -551,6 +1921,8 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
 
     def _access_file(self, name: str, mode: str, stdout=None, stdin=None):
         """Open a file for read or write."""
+        if isinstance(name, bytes):  # bytes mode, the names are kept as str
+            name = os.fsdecode(name)
         try:
             return self._open_files[name]
         except:
@@ -571,6 +1943,8 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         return the_wrapper
 
     def _close_file(self, name):
+        if isinstance(name, bytes):
+            name = os.fsdecode(name)
         try:
             the_file = self._open_files[name]
             the_file.close()
@@ -579,6 +1953,8 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
             pass
 
     def awkpy__fflush(self, name=""):
+        if isinstance(name, bytes):
+            name = os.fsdecode(name)
         if name == "":
             for _, file in self._open_files.items():
                 try:
@@ -611,14 +1987,12 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
             setvar = optn[1]
             if namespace != "awk":
                 setvar = f"{namespace}__{setvar}"
-        # HEURISTIC: if the value is a number, convert it to one
-        # Damned if I know if this is the correct thing to do
-        # it duplicates what we do in the compiler so if we change
-        # one we should change both.
-        try:
-            value = float(val)
-        except:
-            value = val
+        # The value is a numeric string, as in awk. This duplicates
+        # what we do in the compiler so if we change one we should
+        # change both.
+        value = self.awkpy__to_bytes(val) if self._bytes_mode else val
+        if setvar not in ["OFS", "ORS"] and setvar not in self._string_variables:
+            value = _strnum(value)  # OFS & ORS are always strings, see print
         setattr(self, setvar, value)
 
     def _format_g(self, raw_value) -> str:
@@ -628,102 +2002,258 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         return sci_str if len(sci_str) < len(float_str) else float_str
 
     def awkpy__to_string(self, val, format=None):
-        """Perform sprint like conversion using OFMT.
-        NB: Not a very clever implementation, pass floats off to sprintf"""
+        """Perform sprint like conversion using OFMT, or format"""
         if isinstance(val, str):
             return val
         if isinstance(val, int):
             return str(val)
+        if isinstance(val, AwkEmptyVar):
+            return ""
         if format is None:
+            if isinstance(val, float):
+                return self._ofmt(val)
             format = self.OFMT
         return self.sprintf(format, val)
 
-    def _set_dollar_fields(self, line: str):
-        """Set $0 to line, recalculate NF, $1..$NF"""
-        if self.FS in [" ", ""]:
-            line = line.strip(" \t\n\r")
-            FLDS = line.split()
+    def awkpy__to_bytes(self, val, format=None) -> bytes:
+        """awkpy__to_string for bytes mode"""
+        if isinstance(val, bytes):
+            return val
+        if isinstance(val, str):
+            return val.encode("utf-8", "surrogateescape")
+        if isinstance(val, int):
+            return str(val).encode("ascii")
+        if isinstance(val, AwkEmptyVar):
+            return b""
+        if format is None:
+            if isinstance(val, float):
+                return self._ofmt(val).encode("ascii")
+            format = self.OFMT
+        return self.awkpy__to_bytes(self.sprintf(format, val))
+
+    def _string_value(self, val) -> str:
+        """The string value of val, numbers converted using CONVFMT, as
+        when they are concatenated"""
+        cls = val.__class__
+        if cls is str:
+            return val
+        if cls is float:
+            return self._convfmt(val)
+        if cls is AwkStrNum:
+            return str.__str__(val)
+        return self.awkpy__to_string(val)
+
+    def _bytes_value(self, val) -> bytes:
+        """_string_value for bytes mode"""
+        cls = val.__class__
+        if cls is bytes:
+            return val
+        if cls is float:
+            return self._convfmt(val).encode("ascii")
+        if cls is AwkBytesNum:
+            return bytes(val)
+        return self.awkpy__to_bytes(val)
+
+    def _subscript(self, val):
+        """val as an array subscript. Integral numbers are the same
+        subscript whether they're ints or floats, other floats are
+        converted using CONVFMT, as in awk"""
+        if val.__class__ is not float:
+            return val
+        if val.is_integer() and -_integral_limit < val < _integral_limit:
+            return int(val)
+        return self._bytes_value(val) if self._bytes_mode else self._convfmt(val)
+
+    def _set_dollar_fields(self, line):
+        """Set $0 to line. $1..$NF & NF are worked out when first used"""
+        record = self._record
+        # a new FS, FIELDWIDTHS or FPAT applies from the next record
+        record.FS = self._split_FS
+        record.splitter = self._splitter
+        if record.splitter is _split_whitespace:
+            record.line = line.strip(self._whitespace)
+        else:
+            record.line = line.strip(self._line_ends)
+        record.fields = None
+        record.stale = False
+
+    @property
+    def awkpy__flush(self):
+        return self._flush_policy
+
+    @awkpy__flush.setter
+    def awkpy__flush(self, policy):
+        """When output is written, see AwkOutputBuffer"""
+        for file in self._open_files.values():
+            if file.output:
+                file.output.set_policy(policy)
+        self._flush_policy = policy
+
+    @property
+    def OFMT(self):
+        return self._OFMT
+
+    @OFMT.setter
+    def OFMT(self, value):
+        """print formats numbers with OFMT, compiled once per assignment"""
+        self._OFMT = value
+        self._ofmt = _number_formatter(value)
+
+    @property
+    def CONVFMT(self):
+        return self._CONVFMT
+
+    @CONVFMT.setter
+    def CONVFMT(self, value):
+        """Numbers are converted to strings with CONVFMT, compiled once
+        per assignment"""
+        self._CONVFMT = value
+        self._convfmt = _number_formatter(value)
+
+    @property
+    def FS(self):
+        return self._FS
+
+    @FS.setter
+    def FS(self, value):
+        """Fields are separated by FS, classified once per assignment"""
+        self._FS = value
+        if not isinstance(value, (str, bytes)):
+            value = self.awkpy__to_bytes(value) if self._bytes_mode else str(value)
+        if self.awkpy__csv != 0:
+            self._split_FS = None
+            self._splitter = _csv_splitter(value)
+        elif self.awkpy__jsonl != 0:
+            self._split_FS = None
+            self._splitter = _json_splitter(self.awkpy__json_fields, self._bytes_mode)
         else:
-            line = line.strip("\n\r")
-            FLDS = line.split(self.FS)
-        self.NF = len(FLDS)
-        FLDS = [line] + FLDS
-        self._FLDS = defaultdict(AwkEmptyVar, enumerate(FLDS, 0))
+            self._split_FS = value
+            self._splitter = _field_splitter(value)
+
+    @property
+    def awkpy__csv(self):
+        return self._csv
+
+    @awkpy__csv.setter
+    def awkpy__csv(self, value):
+        """CSV input (awkpy::csv) changes how FS splits the fields"""
+        self._csv = value
+        self.FS = self._FS
+
+    @property
+    def awkpy__jsonl(self):
+        return self._jsonl
+
+    @awkpy__jsonl.setter
+    def awkpy__jsonl(self, value):
+        """JSON Lines input (awkpy::jsonl) replaces FS's splitting"""
+        self._jsonl = value
+        self.FS = self._FS
+
+    @property
+    def awkpy__json_fields(self):
+        return self._json_fields
+
+    @awkpy__json_fields.setter
+    def awkpy__json_fields(self, value):
+        """The JSON Lines keys (awkpy::json_fields) become the fields"""
+        self._json_fields = value
+        self.FS = self._FS
+
+    @property
+    def FIELDWIDTHS(self):
+        return self._FIELDWIDTHS
+
+    @FIELDWIDTHS.setter
+    def FIELDWIDTHS(self, value):
+        """Fixed width fields (gawk) until FS is assigned, parsed once"""
+        self._FIELDWIDTHS = value
+        if not value:
+            self.FS = self._FS
+            return
+        if not isinstance(value, (str, bytes)):
+            value = str(value)
+        self._split_FS = None
+        self._splitter = _fixed_width_splitter(value)
+
+    @property
+    def FPAT(self):
+        return self._FPAT
+
+    @FPAT.setter
+    def FPAT(self, value):
+        """Fields are the text matching FPAT (gawk) until FS is assigned"""
+        self._FPAT = value
+        if not value:
+            self.FS = self._FS
+            return
+        if not isinstance(value, (str, bytes)):
+            value = str(value)
+        self._split_FS = None
+        self._splitter = _field_pattern(value)[1]
+
+    @property
+    def NF(self):
+        return len(self._record)
+
+    @NF.setter
+    def NF(self, value):
+        self._record.resize(int(value))
 
     def _set_dollar_field(self, nr, value):
-        """Set $nr to value, recalculate $0.
-        As value may contain FS, we then
-        recalculate the whole $array & NF"""
+        """Set $nr to value, recalculating $0 or $1..$NF"""
         if nr == 0:
             self._set_dollar_fields(value)
         else:
-            self._FLDS[nr] = value
-            sep = " " if self.FS == "" else self.FS
-            flds = [v for k, v in self._FLDS.items()]
-            line = sep.join(flds[1:])
-            self._set_dollar_fields(line)
+            self._record[nr] = value
+
+    def _field_number(self, nr):
+        """The number in $nr, for ++ & --"""
+        field = self._record[nr]
+        if nr == 0:  # the record's text
+            field = AwkBytesNum(field) if self._bytes_mode else AwkStrNum(field)
+        return field + 0
+
+    def _set_field_number(self, nr, value):
+        """$nr = value, after ++ or --"""
+        if nr == 0:  # the record's text
+            value = self._bytes_value(value) if self._bytes_mode else self._string_value(value)
+        self._record[nr] = value
+
+    def _pre_inc_field(self, nr):
+        """self._pre_inc_field(nr) implements ++$nr"""
+        value = self._field_number(nr) + 1
+        self._set_field_number(nr, value)
+        return value
 
-    def sprintf(self, awk: str, *args: list):
-        output = []
-        input_field_nr = -1
+    def _post_inc_field(self, nr):
+        """self._post_inc_field(nr) implements $nr++"""
+        value = self._field_number(nr)
+        self._set_field_number(nr, value + 1)
+        return value
 
-        while awk != "":
-            match = self._sprintf_format_regex.search(awk)
-            if not match:
-                output.append(awk)
-                break
-            start, length = match.regs[0]
-            if start > 0:
-                output.append(awk[:start])
-                awk = awk[start:]
-                continue
-            token = awk[0:length]
-            if repl := self._sprintf_replacements.get(token, None):
-                output.append(repl)
-            elif len(token) < 2:
-                print("Ooops got {0}".format(token))
-            else:  # %...[letter]
-                match = self._sprintf_field_regex.findall(token)
-                if match and len(match) > 0:
-                    parameter, flags, width, precision, pftype = match[0]
-                    parmtype = AwkPySprintfConversion.all_conversions[pftype]
-                    # need to process width/precesion before parameter
-                    # as they can consume input parameters
-                    precision = (
-                        parmtype.default_precision if precision == "" else precision
-                    )
-                    if width != "" or precision != "":
-                        if width == "":
-                            width = "0"
-                        elif width == "*":
-                            input_field_nr += 1
-                            width = str(int(args[input_field_nr]))
-                        if precision != "":
-                            precision = precision.lstrip(".")
-                            if precision == "*":
-                                input_field_nr += 1
-                                precision = str(int(args[input_field_nr]))
-                            width += "." + precision
-                    if parameter == "":
-                        input_field_nr += 1
-                        param_nr = input_field_nr
-                    else:
-                        param_nr = int(parameter[0:-1]) - 1
-                    paramvalue = parmtype.dynamic(args[param_nr])
-                    if len(width) > 0:
-                        if "-" in flags:  # left align numbers
-                            width = ":<" + width
-                        else:
-                            width = ":>" + width
-                        formatter = "{0" + width + parmtype.format_sfx + "}"
-                        token = formatter.format(paramvalue)
-                    else:
-                        token = str(paramvalue)
-                else:
-                    print("Internal error, can't refind {token}")
-                output.append(token)
-            awk = awk[length:]
-        return "".join(output)
+    def _pre_dec_field(self, nr):
+        """self._pre_dec_field(nr) implements --$nr"""
+        value = self._field_number(nr) - 1
+        self._set_field_number(nr, value)
+        return value
+
+    def _post_dec_field(self, nr):
+        """self._post_dec_field(nr) implements $nr--"""
+        value = self._field_number(nr)
+        self._set_field_number(nr, value - 1)
+        return value
+
+    def sprintf(self, awk: str, *args: list):
+        if isinstance(awk, bytes):
+            # bytes mode, latin-1 maps each byte to one character & back
+            args = [
+                arg.decode("latin-1") if isinstance(arg, bytes) else arg
+                for arg in args
+            ]
+            return self.sprintf(awk.decode("latin-1"), *args).encode("latin-1")
+        template, conversions = _sprintf_format(awk)
+        return template(*[convert(args[nr]) for nr, convert in conversions])
 
     def _run(self, argv):
         options = []
@@ -740,170 +2270,166 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         Generators to return input lines from stdin & files
         """
 
-        def _get_stdin_slow():
-            blocksize = int(self.awkpy__blocksize)
-            buffer = sys.stdin.read(blocksize)
-            last_pos = len(buffer)
-            next_pos = 0
-            try:
-                while last_pos != 0:
-                    try:
-                        while next_pos < last_pos:
-                            end = buffer.index(self.RS, next_pos)
-                            yield buffer[next_pos:end]
-                            next_pos = end + 1
-                    except ValueError:
-                        # record split across blocks, advance
-                        # to next block & continue
-                        residue = buffer[next_pos:]
-                        while residue != "" and len(buffer) > 0:
-                            buffer = sys.stdin.read(blocksize)
-                            last_pos = len(buffer)
-                            end = buffer.find(self.RS)
-                            if end < 0:  # not found??? Small buffer?
-                                residue += buffer
-                            else:
-                                yield residue + buffer[:end]
-                                residue = ""
-                                break
-                        if len(residue) > 0:
-                            yield residue
-                    next_pos = end + 1
-                    if next_pos == last_pos and len(buffer) > 0:
-                        buffer = sys.stdin.read(blocksize)
-                        last_pos = len(buffer)
-                        next_pos = 0
-
-            except GeneratorExit:
-                pass  # return, ending the generator
-            pass  # return, ending the generator
+        encoding = None if self._bytes_mode else "utf-8"
+        quote = b'"' if self._bytes_mode else '"'
 
         def _get_stdin():
-            self.FNR = 0
-            self.FILENAME = "-"
-            self._FLDS = []
-            self.NF = 0
-            if self.awkpy__support_RS == 0:
+            """stdin replaced by a stream without a buffer, such as a StringIO"""
+            if self.awkpy__csv != 0:
+                self._current_input = _csv_records(sys.stdin, quote)
+            elif self.awkpy__support_RS == 0 and not self._bytes_mode:
                 self._current_input = sys.stdin
             else:
-                self._current_input = _get_stdin_slow()
-            self.awkpy__BEGINFILE()
+                self._current_input = iter(AwkRecordReader(self, sys.stdin, encoding))
             yield from self._current_input
 
         def _read_from_file_fast():
-            with open(self.FILENAME) as current_file:
+            with _open_input(self, self.FILENAME, encoding) as (current_file, _):
                 self._current_input = current_file
                 yield from current_file
 
-        def _read_from_file_slow():
-            blocksize = int(self.awkpy__blocksize)
-            with open(self.FILENAME, "r") as current_file:
-                self._current_input = current_file
-                buffer = current_file.read(blocksize)
-                last_pos = len(buffer)
-                next_pos = 0
-                try:
-                    while last_pos != 0:
-                        try:
-                            while next_pos < last_pos:
-                                end = buffer.index(self.RS, next_pos)
-                                yield buffer[next_pos:end]
-                                next_pos = end + 1
-                        except ValueError:
-                            # record split across blocks, advance
-                            # to next block & continue
-                            residue = buffer[next_pos:]
-                            while residue != "" and len(buffer) > 0:
-                                buffer = current_file.read(blocksize)
-                                last_pos = len(buffer)
-                                end = buffer.find(self.RS)
-                                if end < 0:  # not found??? Small buffer?
-                                    residue += buffer
-                                else:
-                                    yield residue + buffer[:end]
-                                    residue = ""
-                                    break
-                            if len(residue) > 0:
-                                yield residue
-                        next_pos = end + 1
-                        if next_pos == last_pos and len(buffer) > 0:
-                            buffer = current_file.read(blocksize)
-                            last_pos = len(buffer)
-                            next_pos = 0
-
-                except GeneratorExit:
-                    pass  # return, ending the generator
-                pass  # return, ending the generator
+        def _read_csv_file():
+            """CSV (awkpy::csv) records may contain quoted newlines"""
+            with _open_input(self, self.FILENAME, encoding) as (current_file, _):
+                self._current_input = _csv_records(current_file, quote)
+                yield from self._current_input
 
+        def _read_from_file_slow():
+            with _open_input(self, self.FILENAME) as (current_file, plain):
+                if (
+                    plain
+                    and self.awkpy__mmap != 0
+                    and AwkMmapRecordReader.can_map(current_file)
+                    and AwkMmapRecordReader.can_search(self.RS, encoding)
+                ):
+                    reader = AwkMmapRecordReader(self, current_file, encoding)
+                else:
+                    reader = AwkRecordReader(self, current_file, encoding)
+                    if not plain and int(self.awkpy__blocksize) <= 0:
+                        # stdin, decompressed or read ahead: the file's size is no guide
+                        reader.blocksize = AwkRecordReader.max_blocksize
+                self._current_input = iter(reader)
+                yield from self._current_input
+
+        caught = None
+        previous_handlers = self._catch_signals()
         try:
-            self.awkpy__BEGIN()
-            if (
-                self._has_mainloop
-            ):  # only process files and run mainloop if it has some statements
-                _, argv = (0, ["-"]) if self.ARGC < 1 else (self.ARGC, self.ARGV)
-                for name in argv:
-                    self.ARGIND += 1
-                    if name[0].isalpha() and "=" in name:
-                        self._var_on_commandline(name, name)
-                    else:
-                        self._FLDS = []
-                        self.NF = 0
-                        self.FNR = 0
-                        self.FILENAME = name
-                        if self.FILENAME == "-":
-                            self._current_input = _get_stdin()
+            try:
+                self.awkpy__BEGIN()
+                if (
+                    self._has_mainloop
+                ):  # only process files and run mainloop if it has some statements
+                    _, argv = (0, ["-"]) if self.ARGC < 1 else (self.ARGC, self.ARGV)
+                    # skipping them unless the program has them
+                    runtime = AwkpyRuntimeWrapper
+                    begin_file = type(self).awkpy__BEGINFILE is not runtime.awkpy__BEGINFILE
+                    end_file = type(self).awkpy__ENDFILE is not runtime.awkpy__ENDFILE
+                    for name in argv:
+                        self.ARGIND += 1
+                        if name[0].isalpha() and "=" in name:
+                            self._var_on_commandline(name, name)
                         else:
-                            if self.awkpy__support_RS == 0:
-                                self._current_input = _read_from_file_fast()
+                            self._set_dollar_fields(self._newline[:0])
+                            self.FNR = 0
+                            self.FILENAME = name
+                            if name == "-" and not hasattr(sys.stdin, "buffer"):
+                                records = _get_stdin()
+                            elif self.awkpy__csv != 0:
+                                records = _read_csv_file()
+                            elif self.awkpy__support_RS == 0:
+                                records = _read_from_file_fast()
                             else:
-                                self._current_input = _read_from_file_slow()
-                        self.awkpy__BEGINFILE()
-                        try:
-                            for line in self._current_input:
-                                self._set_dollar_fields(line)
-                                self.NR += 1
-                                self.FNR += 1
-                                self.awkpy__MAINLOOP()
-                        except AwkNextFile:
-                            pass
-                        self.awkpy__ENDFILE()
-        except AwkExit:
-            pass
-        try:
-            self.awkpy__END()
-        except AwkExit:
-            pass
-
-        for _, file in self._open_files.items():
-            file.close()
+                                records = _read_from_file_slow()
+                            self._current_input = records
+                            if begin_file:
+                                self.awkpy__BEGINFILE()
+                            try:
+                                self.awkpy__RECORDS(records)
+                            except AwkNextFile:
+                                pass
+                            finally:  # on exit too, stopping any read ahead thread
+                                records.close()
+                            if end_file:
+                                self.awkpy__ENDFILE()
+            except AwkExit:
+                pass
+            try:
+                self.awkpy__END()
+            except AwkExit:
+                pass
+        except AwkSignal as signalled:
+            caught = signalled.args[0]
+        finally:  # write all the output, whatever happened
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            for file in list(self._open_files.values()):
+                file.close()
+        if caught is not None:  # die of it, as if it hadn't been caught
+            os.kill(os.getpid(), caught)
         set_exit_code(AwkpyRuntimeWrapper._ans)
         return AwkpyRuntimeWrapper._ans
 
-    def __init__(self):
+    def _catch_signals(self):
+        """Make SIGTERM & SIGHUP raise AwkSignal, so pending output is
+        written before the program dies. Signals someone else is
+        handling are left alone. Gives the handlers replaced."""
+        handlers = {}
+        if threading.current_thread() is not threading.main_thread():
+            return handlers  # signal.signal() would fail
+        for name in ("SIGTERM", "SIGHUP"):
+            signum = getattr(signal, name, None)  # no SIGHUP on Windows
+            if signum is not None and signal.getsignal(signum) == signal.SIG_DFL:
+                handlers[signum] = signal.signal(signum, self._on_signal)
+        return handlers
+
+    def _on_signal(self, signum, frame):
+        raise AwkSignal(signum)
+
+    def __init__(self, bytes_mode=False):
         super().__init__()
+        # bytes mode (-b): records, fields & string values are bytes, not str
+        self._bytes_mode = bytes_mode
+        text = (lambda s: s.encode("ascii")) if bytes_mode else str
+        self._newline = text("\n")
+        self._line_ends = text("\n\r")
+        self._whitespace = text(" \t\n\r")
         self.ARGC = 0
         self.ARGV = []
         self.ARGIND = 0
         self.FILENAME = ""
         self.FNR = 0
-        self.FS = " "
-        self.NF = 0
+        # before FS, as they change its meaning
+        self._csv = 0  # (False) awkpy::csv
+        self._jsonl = 0  # (False) awkpy::jsonl
+        self._json_fields = text("")  # (All of them) awkpy::json_fields
+        self.FS = text(" ")
+        self._FIELDWIDTHS = text("")
+        self._FPAT = text("[^ \t\n]+")
+        self._max_field = 0  # (Split all the fields)
+        self._record = AwkRecord(self)  # $0, NF & $1..$NF
+        self._set_dollar_fields(text(""))
         self.NR = 0
-        self.OFS = " "
-        self.ORS = "\n"
+        self.OFS = text(" ")
+        self.ORS = text("\n")
         self.RLENGTH = AwkEmptyVar.instance
         self.RSTART = AwkEmptyVar.instance
-        self.RS = "\n"
-        self.CONVFMT = "%.6g"
-        self.OFMT = "%.6g"
-        self.ENVIRON = defaultdict(AwkEmptyVar.instance, os.environ)
+        self.RS = text("\n")
+        self.RT = text("")
+        self.CONVFMT = text("%.6g")
+        self.OFMT = text("%.6g")
+        environ = os.environb if bytes_mode and os.supports_bytes_environ else os.environ
+        self.ENVIRON = defaultdict(AwkEmptyVar.instance, environ)
         #
         # awkpy namespace
         #
         self.awkpy__wait_for_pipe_close = 0  # (False)
         self.awkpy__support_RS = 1  # (True)
-        self.awkpy__blocksize = -1  # (Read whole file)
+        self.awkpy__blocksize = -1  # (Choose from the file system & file size)
         self.awkpy__local_environ = 1  # (True)
+        self.awkpy__mmap = 0  # (False)
+        self.awkpy__readahead = 0  # (Off, otherwise the number of blocks)
+        self.awkpy__readahead_stall = 0.0  # (Seconds waiting for input)
+        self._flush_policy = text("auto")  # (Lines to a terminal, else blocks)
 
         # files open for input or output
         self._std_in_out = self.awkpy__StdInOutWrapper(self)
@@ -913,14 +2439,6 @@ class AwkpyRuntimeWrapper(AwkpyRuntimeVarOwner):
         # if no statements are present in the main loop,
         # input files are not processed
         self._has_mainloop = False
-        # used by sprintf
-        self._sprintf_require_int = AwkPySprintfConversion.all_conversions["d"]
-        fieldspec = (
-            r"([0-9]*\$)?([-+ 0'#])?([1-9*][0-9]*)?([.][0-9*]+)?([aAcdeEfFgGiosuxX])"
-        )
-        self._sprintf_field_regex = re.compile(fieldspec)
-        self._sprintf_format_regex = re.compile(r"([\\%]%)|([{}])|(%" + fieldspec + ")")
-        self._sprintf_replacements = {r"\%": "%", "%%": "%", "{": "{", "}": "}"}
 
 
 def set_exit_code(code):
@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+""" AWK - Python translator tests
+    fixtures shared by all the tests """
+#
+# Copyright (C) 2022 Julia Ingleby Clement
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def compiled_program_cache(monkeypatch, tmp_path):
+    """Keep the programs the tests compile out of the user's cache,
+    including those of awkpy.py run as a subprocess"""
+    monkeypatch.setenv("AWKPY_CACHE_DIR", str(tmp_path / "awkpy_cache"))
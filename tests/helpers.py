@@ -42,6 +42,8 @@ from awkpy_compiler import AwkPyCompiler
 from awkpy_runtime import (
     AwkEmptyVar,
     AwkEmptyVarInstance,
+    AwkStrNum,
+    AwkBytesNum,
     AwkNextFile,
     AwkExit,
     AwkpyRuntimeWrapper,
@@ -97,6 +99,16 @@ def compile_run(awk: str, files: list = [empty_txt]):
     return AwkpyRuntimeWrapper._ans
 
 
+def compile_assert_source(awk: str, expected: list, unexpected: list = ()) -> str:
+    """the Python compiled from awk contains each of expected & none of unexpected"""
+    python_source = AwkPyCompiler().compile(awk)
+    for code in expected:
+        assert code in python_source
+    for code in unexpected:
+        assert code not in python_source
+    return python_source
+
+
 def compile_run_capsys_assert(
     capsys, expected: str, awk: str, files: list = [empty_txt]
 ):
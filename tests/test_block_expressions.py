@@ -20,6 +20,7 @@
 
 import pytest
 from helpers import (
+    compile_assert_source,
     compile_run_answer_assert,
     compile_run_capsys_assert,
     full_file_name,
@@ -122,6 +123,77 @@ BEGIN {
     )
 
 
+def test_for_continue(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "1 2 3 3:3:1\n",
+        """
+BEGIN {
+    t=5;
+    for(i=0; t>1; --t) {
+        if (t == 3)
+            continue;
+        i+=1;
+        printf "%d ", i;
+        for (j=0; j<3; j++)
+            continue;
+    }
+    print i":"j":"t
+}""",
+    )
+
+
+@pytest.mark.parametrize(
+    "awk,expected",
+    [
+        ("NR == 2 { for (i = 1; i <= NF; i++) print $i }", "Line.2\n--\nDuplicated\n"),
+        ("BEGIN { for (i = 10; i > 0; i--) s = s i; print s, i }", "10987654321 0\n"),
+        ("BEGIN { for (i = 0; i < 9; ++i) if (i == 3) break; print i }", "3\n"),
+        ("BEGIN { for (i = 0; i < 9; i++) i++; print i }", "10\n"),
+        ("BEGIN { n = 3; for (i = 0; i < n; i++) print i }", "0\n1\n2\n"),
+        ("NR == 2 { for (i = 1; i <= NF; i++) $i = $i $i; print }", "Line.2Line.2 ---- DuplicatedDuplicated\n"),
+        ("NR == 2 { for (i = 1; i <= NF; i++) NF = 2; print i, $0 }", "3 Line.2 --\n"),
+        ("{ for (i = 1; i <= NF; i++) getline; print i, $0 }", "3 Line.3\n2 Line.2\n"),
+        ("function f() { i = 9 } BEGIN { for (i = 0; i < 3; i++) f(); print i }", "10\n"),
+        (
+            "function f(n, i) { for (i = 0; i < 3; i++) g(); return i } "
+            'function g() { c++ } BEGIN { print f(), c, "[" i "]" }',
+            "3 3 []\n",
+        ),
+        (
+            """
+BEGIN {
+    for (i = 1; i <= 4; i++)
+        s = s i;
+    for (j = 1; j <= 4; j++)
+        if (j == 2)
+            break;
+    for (k = 3; k > 0; --k)
+        continue;
+    for (m = 1; m < 1; m++)
+        s = "wrong";
+    print s, i, j, k, m
+}""",
+            "1234 5 2 0 1\n",
+        ),
+    ],
+)
+def test_for_counter(capsys, awk, expected):
+    compile_run_capsys_assert(capsys, expected, awk, [full_file_name("lines.txt")])
+
+
+@pytest.mark.parametrize(
+    "awk,expected,unexpected",
+    [
+        ("{ for (i = 1; i <= NF; i++) print $i }", ["in range(1, self.NF+1):", "_record_.text(i_)"], ["while"]),
+        ("BEGIN { for (i = 10; i > 0; i--) print i }", ["in range(10, 0, -1):", "i_=0"], []),
+        ("BEGIN { for (i = 0; i < 9; i++) i++ }", ["while i_<9:"], ["range("]),
+    ],
+)
+def test_for_counter_compiled(awk, expected, unexpected):
+    assert "yield" not in compile_assert_source(awk, expected, unexpected)
+
+
 def test_while(capsys):
     compile_run_capsys_assert(
         capsys,
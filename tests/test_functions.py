@@ -479,6 +479,25 @@ def test_sprintf_compiled_G_to_E():
     )
 
 
+@pytest.mark.parametrize(
+    "fmt,args,expected",
+    [
+        ("%-5s|%3d|", '"ab", 7', "ab   |  7|"),
+        ("%*d|%-*s|", '4, 9, 3, "z"', "   9|z  |"),
+        ("%*.*f", "8, 2, 3.14159", "    3.14"),
+        ("%2$s %1$s", '"a", "b"', "b a"),
+        ("%%{x}\\\\%%.3s", '"xyzw"', "%{x}%xyz"),
+        ("%x %X %o %c", '255, 255, 8, "hello"', "ff FF 10 h"),
+    ],
+)
+def test_sprintf_runtime_format(fmt, args, expected):
+    """formats only known when the program runs, compiled & cached by the runtime"""
+    for _ in range(2):  # parsed, then from the cache
+        compile_run_answer_assert(
+            expected, f'BEGIN {{ fmt = "{fmt}"; exit sprintf(fmt, {args}) }}'
+        )
+
+
 def test_sprintf_compiled_i():  # POSIX spec says synonym for d
     compile_run_answer_assert(
         "7",
@@ -784,6 +803,42 @@ BEGIN {
     )
 
 
+@pytest.mark.parametrize(
+    "separator, answer",
+    [
+        ("/[,;]+/", "3 c"),
+        ('"[,;]+"', "3 c"),
+        ('";"', "4 "),
+        ('" "', "1 "),
+        ('""', "7 ;"),
+    ],
+)
+def test_split_function_call_separators(capsys, separator, answer):
+    compile_run_capsys_assert(
+        capsys,
+        answer + "\n",
+        f"""
+BEGIN {{
+    n=split("a,;b;;c",y,{separator})
+    print n, y[3]
+}}""",
+    )
+
+
+def test_patsplit_function_call(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "2 12 345 <ab> <cd> <e>\n3 z\n",
+        """
+BEGIN {
+    n=patsplit("ab12cd345e", a, /[0-9]+/, seps)
+    print n, a[1], a[2], "<" seps[0] ">", "<" seps[1] ">", "<" seps[2] ">"
+    n=patsplit("x y  z", b)
+    print n, b[3]
+}""",
+    )
+
+
 def test_substr_function_call_1():
     compile_run_answer_assert(
         "3456",
@@ -18,10 +18,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bz2
+import gzip
 import io
+import lzma
 import pytest
 from pathlib import Path
 import math
+import signal
+import subprocess
 import sys
 from helpers import full_file_name, Fuzzy
 
@@ -305,6 +310,303 @@ def test_RS(capsys, monkeypatch):
     assert captured.out == "cd\n--\n"
 
 
+@pytest.mark.parametrize("blocksize", ["1", "3", "7", "-1"])
+def test_RS_records_straddle_blocks(capsys, tmp_path, blocksize):
+    file = tmp_path / "records.txt"
+    file.write_text("alpha;bé;;gamma delta;ε")
+    awkpy.run(
+        [
+            "awkpy_out",
+            f"-vawkpy::blocksize={blocksize}",
+            """BEGIN {RS=";"; ORS="|"} {print NR ":" $0}""",
+            str(file),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == "1:alpha|2:bé|3:|4:gamma delta|5:ε|"
+
+
+def test_RS_multibyte_separator_straddles_blocks(capsys, tmp_path):
+    file = tmp_path / "records.txt"
+    file.write_text("aé€bé€c")
+    awkpy.run(
+        [
+            "awkpy_out",
+            "-vawkpy::blocksize=2",
+            """BEGIN {RS="é€"; ORS="|"} {print $0}""",
+            str(file),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == "a|b|c|"
+
+
+def test_RS_changed_between_records(capsys, tmp_path):
+    file = tmp_path / "records.txt"
+    file.write_text("a\nb,c\nd")
+    awkpy.run(["awkpy_out", """NR==1 {RS=","} {print NR ":" $0}""", str(file)])
+    captured = capsys.readouterr()
+    assert captured.out == "1:a\n2:b\n3:c\nd\n"
+
+
+@pytest.mark.parametrize("blocksize", ["1", "2", "3", "-1"])
+def test_RS_regex_sets_RT(capsys, tmp_path, blocksize):
+    file = tmp_path / "records.txt"
+    file.write_text("a12b345c6d")
+    awkpy.run(
+        [
+            "awkpy_out",
+            f"-vawkpy::blocksize={blocksize}",
+            """BEGIN {RS="[0-9]+"; ORS="|"} {print $0 "=" RT}""",
+            str(file),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == "a=12|b=345|c=6|d=|"
+
+
+@pytest.mark.parametrize("blocksize", ["1", "2", "5", "-1"])
+def test_RS_paragraph_mode(capsys, tmp_path, blocksize):
+    file = tmp_path / "records.txt"
+    file.write_text("\n\nrec one\nline;2\n\n\n\nrec two\n\n")
+    awkpy.run(
+        [
+            "awkpy_out",
+            f"-vawkpy::blocksize={blocksize}",
+            """BEGIN {RS=""; FS=";"; ORS="|"} {n=length(RT); print NR, $1, n}
+            NR==1 {print $2, $3}""",
+            str(file),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == "1 rec one 4|line 2|2 rec two 2|"
+
+
+@pytest.mark.parametrize(
+    "rs,expected",
+    [
+        ("\\n", "1:a=\n|2:b;c=\n|3:=\n|4:dé=|"),
+        (";", "1:a\nb=;|2:c\n\ndé=|"),
+        ("[;\\n]+", "1:a=\n|2:b=;|3:c=\n\n|4:dé=|"),
+    ],
+)
+def test_mmap_input(capsys, tmp_path, rs, expected):
+    file = tmp_path / "records.txt"
+    file.write_text("a\nb;c\n\ndé")
+    awkpy.run(
+        [
+            "awkpy_out",
+            "-vawkpy::mmap=1",
+            f"""BEGIN {{RS="{rs}"; ORS="|"}} {{print NR ":" $0 "=" RT}}""",
+            str(file),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == expected
+
+
+def test_mmap_falls_back_for_stdin_and_empty_files(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("Line.4 ++"))
+    awkpy.run(
+        [
+            "awkpy_out",
+            "-vawkpy::mmap=1",
+            '$1=="Line.4"{print $2}',
+            "-",
+            full_file_name("empty.txt"),
+            full_file_name("lines.txt"),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == "++\n--\n"
+
+
+@pytest.mark.parametrize("mmap", ["0", "1"])
+def test_multibyte_regex_RS(capsys, tmp_path, mmap):
+    file = tmp_path / "records.txt"
+    file.write_text("one\naé;b\néé")
+    for program in [
+        'BEGIN {RS="[é;]"; ORS="|"} {print NR ":" $0 "=" RT}',
+        '{print NR ":" $0 "=" RT; RS="[é;]"; ORS="|"}',  # changed part way through
+    ]:
+        awkpy.run(["awkpy_out", f"-vawkpy::mmap={mmap}", program, str(file)])
+    captured = capsys.readouterr()
+    assert captured.out == (
+        "1:one\na=é|2:=;|3:b=é|4:=é|"
+        "1:one=\n\n2:a=é|3:=;|4:b=é|5:=é|"
+    )
+
+
+@pytest.mark.parametrize("mmap", ["0", "1"])
+def test_bytes_mode(capsysbinary, tmp_path, mmap):
+    file = tmp_path / "latin1.txt"
+    file.write_bytes(b"caf\xe9 1;na\xefve 22;d\xe9j\xe0 333")
+    awkpy.run(
+        [
+            "awkpy_out",
+            "-b",
+            f"-vawkpy::mmap={mmap}",
+            "-vx=é",
+            'BEGIN {RS=";"} /\udce9/ {gsub(/[ae]/, "<&>"); print length($1), $0, x}',
+            str(file),
+        ]
+    )
+    captured = capsysbinary.readouterr()
+    assert captured.out == b"6 c<a>f\xe9 1 \xc3\xa9\n4 d\xe9j\xe0 333 \xc3\xa9\n"
+
+
+def test_bytes_mode_regex_RS_and_printf(capsysbinary, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.BytesIO(b"a\xff1b22\n"))
+    awkpy.run(
+        [
+            "awkpy_out",
+            "-b",
+            'BEGIN {RS="[0-9]+"} {printf "%s=%s|", $0, RT; a[$0]++} END {print a["b"]}',
+        ]
+    )
+    captured = capsysbinary.readouterr()
+    assert captured.out == b"a\xff=1|b=22|=|1\n"
+
+
+def test_csv(capsys, tmp_path):
+    file = tmp_path / "people.csv"
+    file.write_text('name,address\n"Smith, J","1 High St\nTown"\n')
+    awkpy.run(
+        [
+            "awkpy_out",
+            "--csv",
+            'NR==2 {print NF, $1; print; $1="Jones"; print; print $2 }',
+            str(file),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == (
+        '2,"Smith, J"\n"Smith, J","1 High St\nTown"\n'
+        'Jones,"1 High St\nTown"\n"1 High St\nTown"\n'
+    )
+
+
+def test_csv_variable_reads_csv_only(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO('a,"b,c"\td\n'))
+    awkpy.run(["awkpy_out", "{print NF, $2}", "-Wr", "-vawkpy::csv=1"])
+    captured = capsys.readouterr()
+    assert captured.out == "2 b,c\td\n"
+
+
+JSON_LINES = (
+    '{"level": "info", "msg": "hi", "user": {"id": 7, "tags": ["a", "b"]}}\n'
+    '{"level": "error", "msg": "bad", "user": null, "ok": true}\n'
+    "not json\n"
+)
+
+
+def test_jsonl_fields(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO(JSON_LINES))
+    awkpy.run(
+        [
+            "awkpy_out",
+            "-vawkpy::jsonl=1",
+            "-vawkpy::json_fields=level ok",
+            '{print NF, $1, $2} $1=="error" {print awkpy::json("msg")}',
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == "2 info \n2 error 1\nbad\n0  \n"
+
+
+def test_jsonl_keyed_access(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO(JSON_LINES))
+    awkpy.run(
+        [
+            "awkpy_out",
+            '{print awkpy::json("user", "tags", 2), awkpy::json("user")}',
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == 'b {"id":7,"tags":["a","b"]}\n \n \n'
+
+
+@pytest.mark.parametrize("support_RS", ["0", "1"])
+@pytest.mark.parametrize("compressor", [gzip, bz2, lzma])
+def test_compressed_input(capsys, tmp_path, compressor, support_RS):
+    file = tmp_path / "lines.log"  # recognised by content, not name
+    file.write_bytes(compressor.compress(b"a 1\nb 2\nc 3\n"))
+    awkpy.run(
+        [
+            "awkpy_out",
+            f"-vawkpy::support_RS={support_RS}",
+            '$2 != "1" {print $1} END {print FILENAME}',
+            str(file),
+        ]
+    )
+    captured = capsys.readouterr()
+    assert captured.out == f"b\nc\n{file}\n"
+
+
+@pytest.mark.parametrize("support_RS", ["0", "1"])
+@pytest.mark.parametrize("program", ["NR == 2 {nextfile}", "NR == 2 {exit}"])
+def test_read_ahead(capsys, tmp_path, program, support_RS):
+    file = tmp_path / "lines.gz"
+    file.write_bytes(gzip.compress(b"".join(b"%d\n" % n for n in range(100000))))
+    program += ' END {if (awkpy::readahead_stall >= 0) print NR, "ok"}'
+    awkpy.run(
+        [
+            "awkpy_out",
+            "-vawkpy::readahead=2",
+            f"-vawkpy::support_RS={support_RS}",
+            "-vawkpy::blocksize=4096",
+            "{print} " + program,
+            str(file),
+            str(full_file_name("lines.txt")),
+        ]
+    )
+    captured = capsys.readouterr()
+    if "{exit}" in program:
+        assert captured.out == "0\n1\n2 ok\n"
+    else:
+        assert captured.out.startswith("0\n1\nLine.1")
+        assert captured.out.endswith(" ok\n")
+
+
+@pytest.mark.parametrize("readahead", ["0", "2"])
+@pytest.mark.parametrize("support_RS", ["0", "1"])
+@pytest.mark.parametrize("compress", [bytes, gzip.compress, bz2.compress, lzma.compress])
+def test_piped_stdin(compress, support_RS, readahead):
+    # through a pipe stdin is sys.stdin.buffer, which capsys can't stand in for
+    awkpy_py = Path(__file__).parent.parent / "code" / "awkpy.py"
+    result = subprocess.run(
+        [sys.executable, str(awkpy_py), "-Wnocache"]
+        + [f"-vawkpy::support_RS={support_RS}", f"-vawkpy::readahead={readahead}"]
+        + ['$2 != "1" {print $1}'],
+        input=compress(b"a 1\nb 2\nc 3\n"),
+        capture_output=True,
+        timeout=60,
+    )
+    assert result.stderr == b""
+    assert result.stdout == b"b\nc\n"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs POSIX signals")
+def test_output_written_on_SIGTERM(tmp_path):
+    awkpy_py = Path(__file__).parent.parent / "code" / "awkpy.py"
+    program = '{print; print "ready" > "/dev/stderr"}'  # stdout is block buffered
+    process = subprocess.Popen(
+        # reading lines, so the first is processed without waiting for more
+        [sys.executable, str(awkpy_py), "-Wnocache", "-vawkpy::support_RS=0"]
+        + [program],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    process.stdin.write(b"a line\n")
+    process.stdin.flush()
+    assert process.stderr.readline() == b"ready\n"
+    process.send_signal(signal.SIGTERM)
+    out, _ = process.communicate(timeout=10)
+    assert out == b"a line\n"
+    assert process.returncode == -signal.SIGTERM
+
+
 def test_use_stdin_ahead_of_files(capsys, monkeypatch):
     monkeypatch.setattr("sys.stdin", io.StringIO("Line.4 ++"))
     file = str(full_file_name("lines.txt"))
@@ -422,6 +724,58 @@ def test_include_includes_file_only_once():
     assert AwkpyRuntimeWrapper._ans == 1
 
 
+def test_compiled_program_cache(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("AWKPY_CACHE_DIR", str(tmp_path))
+    for _ in range(2):
+        awkpy.run(["awkpy_out", "-vA=cached", "BEGIN {print A}"])
+        captured = capsys.readouterr()
+        assert captured.out == "cached\n"
+    assert len(list(tmp_path.glob("*.awkpyc"))) == 1
+    # -v initial values are compiled into the program, so are part of the key
+    awkpy.run(["awkpy_out", "-vA=other", "BEGIN {print A}"])
+    captured = capsys.readouterr()
+    assert captured.out == "other\n"
+    assert len(list(tmp_path.glob("*.awkpyc"))) == 2
+
+
+def test_compiled_program_cache_disabled(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("AWKPY_CACHE_DIR", str(tmp_path))
+    awkpy.run(["awkpy_out", "-Wnocache", "BEGIN {print 1}"])
+    captured = capsys.readouterr()
+    assert captured.out == "1\n"
+    assert len(list(tmp_path.glob("*.awkpyc"))) == 0
+
+
+def test_compiled_program_cache_evicts_lru(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("AWKPY_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("AWKPY_CACHE_SIZE", "2")
+    for i in range(4):
+        awkpy.run(["awkpy_out", f"BEGIN {{print {i}}}"])
+    assert len(list(tmp_path.glob("*.awkpyc"))) == 2
+
+
+def test_compiled_program_cache_source_file_changed(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("AWKPY_CACHE_DIR", str(tmp_path / "cache"))
+    source = tmp_path / "prog.awk"
+    source.write_text('BEGIN {print "one"}')
+    awkpy.run(["awkpy_out", "-f", str(source)])
+    source.write_text('BEGIN {print "two, longer"}')
+    awkpy.run(["awkpy_out", "-f", str(source)])
+    captured = capsys.readouterr()
+    assert captured.out == "one\ntwo, longer\n"
+
+
+def test_compiled_program_cache_include_directory(capsys, monkeypatch, tmp_path):
+    monkeypatch.setenv("AWKPY_CACHE_DIR", str(tmp_path / "cache"))
+    for directory in ["a", "b", "a"]:
+        (tmp_path / directory).mkdir(exist_ok=True)
+        monkeypatch.chdir(tmp_path / directory)
+        Path("lib.awk").write_text(f'function f() {{ return "{directory}" }}')
+        awkpy.run(["awkpy_out", '@include "lib.awk"\nBEGIN {print f()}'])
+    captured = capsys.readouterr()
+    assert captured.out == "a\nb\na\n"
+
+
 if __name__ == "__main__":
     awkpy.run(
         [
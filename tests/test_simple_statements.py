@@ -22,6 +22,7 @@ import tempfile
 import pytest
 from os import environ
 from helpers import (
+    compile_assert_source,
     compile_run,
     compile_run_answer_assert,
     compile_run_capsys_assert,
@@ -30,8 +31,10 @@ from helpers import (
     full_file_name,
     temp_file_name,
     check_arg_parser,
+    empty_txt,
 )
-from awkpy_runtime import AwkpyRuntimeWrapper
+from awkpy_runtime import AwkOutputBuffer, AwkpyRuntimeWrapper
+from awkpy_compiler import AwkPyCompiler
 
 
 def test_getline_default(capsys, monkeypatch):
@@ -263,6 +266,33 @@ def test_print_to_file_overwrite_with_fflush_all(capsys, tmp_path):
     assert_equal("Line.1", retrieved)
 
 
+@pytest.mark.parametrize(
+    "policy, interactive, expected",
+    [
+        ("block", True, ""),
+        ("auto", False, ""),
+        ("auto", True, "Line.1\n"),
+        ("line", False, "Line.1\n"),
+        ("record", False, "Line.1\nLine.2"),
+    ],
+)
+def test_output_flush_policy(policy, interactive, expected):
+    """what has been written before the output is closed"""
+    stream = io.StringIO()
+    output = AwkOutputBuffer(stream, "\n", policy, interactive)
+    output.write("Line.1\n")
+    output.write("Line.2")
+    assert_equal(expected, stream.getvalue())
+    output.flush()
+    assert_equal("Line.1\nLine.2", stream.getvalue())
+
+
+def test_print_flushed_before_system(capfd):
+    compile_run(r'BEGIN {print "a"; system("echo b"); printf "c\n"}')
+    captured = capfd.readouterr()
+    assert_equal("a\nb\nc\n", captured.out)
+
+
 def test_delete_array(capsys):
     compile_run_capsys_assert(
         capsys,
@@ -435,6 +465,210 @@ END {
     )
 
 
+@pytest.mark.parametrize(
+    "awk,assigns",
+    [
+        ("{ print $1, $2 }", False),
+        ('{ x = OFS; if (ORS == "\\n") print x }', False),
+        ('BEGIN { OFS = "-" } { print }', True),
+        ("{ ORS++ }", True),
+        ("{ getline OFS }", True),
+        ('{ sub(/a/, "b", ORS) }', True),
+    ],
+)
+def test_print_separators_assigned(awk, assigns):
+    compiler = AwkPyCompiler()
+    python_source = compiler.compile(awk)
+    assert compiler.assigns_separators == assigns
+
+
+@pytest.mark.parametrize(
+    "awk,expected",
+    [
+        (
+            '$2 { print $1, 3, "[" x "]", $2 } END { x = 2.5; print x, NR }',
+            "Line.2 3 [] --\nLine.4 3 [] --\n2.5 5\n",
+        ),
+        (
+            '$2 { $2 = NR; print $1, 3, "[" x "]", $2 } END { x = 2.5; print x, NR }',
+            "Line.2 3 [] 2\nLine.4 3 [] 4\n2.5 5\n",
+        ),
+        (
+            ["-e", "NR < 3 { print $1, NR }", "-e", '{ OFS = "-" }'],
+            "Line.1 1\nLine.2-2\n",
+        ),
+    ],
+)
+def test_print_values(capsys, awk, expected):
+    compile_run_capsys_assert(capsys, expected, awk, [full_file_name("lines.txt")])
+
+
+def test_print_with_numeric_OFS(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "Line.101\n",
+        "NR == 1 { print $1, 1 }",
+        ["OFS=0", full_file_name("lines.txt")],
+    )
+
+
+@pytest.mark.parametrize(
+    "awk,expected",
+    [
+        ("BEGIN { print 0.1 + 0.2, 123456789.5, 3.0, -2.0 * 4 }", "0.3 1.23457e+08 3 -8\n"),
+        ('BEGIN { OFMT = "%.2f"; x = 3.14159; print x, x "" }', "3.14 3.14159\n"),
+        ('BEGIN { CONVFMT = "%.2f"; x = 3.14159; print x, x "" }', "3.14159 3.14\n"),
+        ('BEGIN { x = 3.14159; OFMT = "%.2f"; print x; OFMT = "%.3e"; print x }', "3.14\n3.142e+00\n"),
+        ('BEGIN { OFMT = "[%5.1f]"; print 2.25, 2.0 }', "[  2.2] 2\n"),
+        ('BEGIN { OFMT = "%x!"; print 255.5; OFMT = "%5.1f%%"; print 2.25 }', "ff!\n  2.2%\n"),
+    ],
+)
+def test_number_formats(capsys, awk, expected):
+    compile_run_capsys_assert(capsys, expected, awk)
+
+
+def test_float_subscripts(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "1 one\n0.5 half\nthird third\n",
+        'BEGIN { CONVFMT = "%.2f"; a[1] = "one"; x = 0.5; a[x] = "half"; '
+        'a[x * 0.666] = "third"; print 2*x, a[2*x]; print x, a["0.50"]; print a[0.333], a["0.33"] }',
+    )
+
+
+def test_strnum_fields(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a 1 5\nb x 7\nc 2 3.50\nd 10 -1\n"))
+    compile_run_capsys_assert(
+        capsys,
+        "lt 1\nlt 2\n14.5 7 3.50 2 12\n",
+        '{ s += $3; if ($3 > max) max = $3; if ($2 < 9) print "lt", $2 } '
+        '$3 == 3.5 { x = $3 } END { print s, max, x, n + 1, y * 2 }',
+        ["-v", "n=1", "-v", "y=6.0"],
+    )
+
+
+@pytest.mark.parametrize(
+    "awk,files,expected",
+    [
+        ('{ n++ } END { if (n > 2) print "many" }', ["-"], "many\n"),
+        ('{ n++ } END { print "[" n "]" }', [empty_txt], "[]\n"),
+        ("{ a[$1]++ } END { for (k in a) print k, a[k] }", ["-"], "a 2\nb 1\n"),
+        ('{ a[$1]++; if (a[$2] > 1) x = 1 } END { print a["a"] + a["b"], x + 0 }', ["-"], "3 0\n"),
+        ('{ if (a[$1] == 0) print; a[$1]++ } END { print "[" a["x"] "]" }', ["-"], "a 1\nb 2\n[]\n"),
+        ('{ s = s "-" $1 } END { print s }', ["-"], "-a-b-a\n"),
+        ('{ s = $1 } END { print "[" s "]" }', [empty_txt], "[]\n"),
+        ('{ s = "x"; s = 1 } END { print "[" s "]" }', [empty_txt], "[]\n"),
+        ('{ w[$1] = w[$1] $2 } END { print w["a"], "[" w["c"] "]" }', ["-"], "13 []\n"),
+        ("function f(x, i) { i++; return x i } { print f($1) }", ["-"], "a1\nb1\na1\n"),
+        ('{ n++ } END { m = n; print m "" }', [empty_txt], "\n"),
+        ('{ c[$1] += 2 } END { x = c["q"]; print x }', ["-"], "\n"),
+        ("function f(a, loc) { loc[a] = 1; return length(loc) } BEGIN { print f(1); print f(2) }", [], "1\n1\n"),
+        ("function f(a, loc) { loc[a]++; return length(loc) } BEGIN { print f(1); print f(2) }", [], "1\n1\n"),
+        (
+            'function f(s, parts, n, k) { n = split(s, parts, ","); for (k in parts) n = n parts[k]; return n } '
+            'BEGIN { print f("a,b"), f("c") }',
+            [],
+            "2ab 1c\n",
+        ),
+        (
+            '{ x = y; n++; c[$1]++; w = w $1 $2 " " } '
+            'END { print n + 0, x "|" "a", c["a"], "b", c["b"], w t }',
+            ["t=x", "w=1", "-"],
+            "3 |a 2 b 1 1a1 b2 a3 x\n",
+        ),
+    ],
+)
+def test_variable_types(capsys, monkeypatch, awk, files, expected):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a 1\nb 2\na 3\n"))
+    compile_run_capsys_assert(capsys, expected, awk, files)
+
+
+@pytest.mark.parametrize(
+    "awk,expected",
+    [
+        ("{ n++ } END { if (n > 3) exit 1 }", ["self.n=0", "n_+=1"]),
+        ("{ a[$1]++ } END { for (k in a) print k, a[k] }", ["defaultdict(int)"]),
+        ('{ w[$1] = w[$1] $2 } END { print w["a"] }', ["defaultdict(str)"]),
+    ],
+)
+def test_variable_types_compiled(awk, expected):
+    compile_assert_source(awk, expected)
+
+
+@pytest.mark.parametrize("options", [[], ["-Wnohoist"]])
+@pytest.mark.parametrize(
+    "awk,expected",
+    [
+        ("BEGIN { i = 0; while (i < 9) i++; print i }", "9\n"),
+        ("{ n++ } END { print NR, NR - n }", "4 0\n"),
+        ("{ getline; print NR, NR }", "2 2\n4 4\n"),
+        ('{ getline x; x = x "a" x; print x }', "bab\ndad\n"),
+        ("function f() { t++ } { t = t + 1; f() } END { print t }", "8\n"),
+        ("function f() { return t } { t = t + 1; t = f() } END { print t }", "4\n"),
+        ("function f() { t = t + 1; t = t * 2; next } { f() } END { print t }", "30\n"),
+        ("BEGIN { t = t + 1; t = t * 2; if (t) exit } END { print t }", "2\n"),
+        (
+            "function f() { return c } function g() { exit } "
+            "{ c = c + 1; c = c * 2; t = f(); if (NR == 2) g() } "
+            "END { print NR, c, t + 1, NR - 1 }",
+            "2 6 7 1\n",
+        ),
+    ],
+)
+def test_hoist_globals(capsys, monkeypatch, options, awk, expected):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a\nb\nc\nd\n"))
+    compile_run_capsys_assert(capsys, expected, options + ["-e", awk], ["-"])
+
+
+@pytest.mark.parametrize(
+    "awk,expected,unexpected",
+    [
+        ("BEGIN { while (i < 9) i++ }", ["i_ = self.i", "while i_<9:", "self.i = i_"], []),
+        ("{ getline; print NR, NR }", [], ["NR_ = "]),
+        ("function f() { t++ } { t = t + 1; f() }", [], ["t_ = "]),
+    ],
+)
+def test_hoist_globals_compiled(awk, expected, unexpected):
+    compile_assert_source(awk, expected, unexpected)
+    assert "_ = self." not in AwkPyCompiler().compile(["-Wnohoist", "-e", awk])
+
+
+@pytest.mark.parametrize(
+    "awk,expected",
+    [
+        ("{ if ($1 ~ /2/) next; print }", "Line.1\nLine.3\nLine.4 -- Don't go here\n"),
+        ("{ if ($1 ~ /3/) nextfile; print }", "Line.1\nLine.2 -- Duplicated\n"),
+        ("{ while ($1 ~ /2/) next; print }", "Line.1\nLine.3\nLine.4 -- Don't go here\n"),
+        ("function f() { next } /2/ { f() } { print }", "Line.1\nLine.3\nLine.4 -- Don't go here\n"),
+        (
+            'FNR == 1 { next } FNR > 3 { nextfile } { i = 0; while (i < 5) { i++; if ($2 == "--") next } '
+            "print NR, $1 } ENDFILE { n++ } END { print n, NR }",
+            "3 Line.3\n1 4\n",
+        ),
+    ],
+)
+def test_records_loop(capsys, awk, expected):
+    compile_run_capsys_assert(capsys, expected, awk, [full_file_name("lines.txt")])
+
+
+@pytest.mark.parametrize(
+    "awk,expected,unexpected",
+    [
+        ("{ if ($1) next; print }", ["for _line in records:", "continue"], ["except AwkNext"]),
+        ("{ print }", [], ["BEGINFILE", "ENDFILE", "MAINLOOP"]),
+    ],
+)
+def test_records_loop_compiled(awk, expected, unexpected):
+    compile_assert_source(awk, expected, unexpected)
+
+
+def test_records_loop_left_alone_when_invalid():
+    """a compiler bug is reported by Python compiling the program"""
+    loop = AwkPyCompiler().records_loop(["        raise AwkNext", "        x = = 1"])
+    assert "raise AwkNext" in loop[-4] and "x = = 1" in loop[-3]
+    assert loop[-2].strip() == "except AwkNext:"
+
+
 def test_nextfile(capsys):
     compile_run_capsys_assert(
         capsys,
@@ -444,6 +678,217 @@ def test_nextfile(capsys):
     )
 
 
+def test_NF(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "1 \n3 --\n1 \n5 --go\n1 \n",
+        "{ n=NF; print n, $2 $4 }",
+        [full_file_name("lines.txt")],
+    )
+
+
+def test_field_beyond_NF_is_not_added(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "[] 3\n[] 5\n",
+        '$3 { x = $9; print "[" x "]", NF }',
+        [full_file_name("lines.txt")],
+    )
+
+
+def test_field_assignment_rebuilds_dollar_0_with_OFS(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a b  c\nd"))
+    compile_run_capsys_assert(
+        capsys,
+        "A-B-C-3\nD-1\n",
+        'BEGIN { OFS="-" } { for (i = 1; i <= NF; i++) $i = toupper($i); print $0, NF }',
+        [],
+    )
+
+
+def test_NF_assignment(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a b c d"))
+    compile_run_capsys_assert(
+        capsys,
+        "a b\na b   x 5\n",
+        "{ NF = 2; print; $5 = \"x\"; print $0, NF }",
+        [],
+    )
+
+
+def test_dollar_0_assignment_resplits(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a b c"))
+    compile_run_capsys_assert(
+        capsys,
+        "q 2\n",
+        '{ $2 = "x"; $0 = "p q"; print $2, NF }',
+        [],
+    )
+
+
+def test_field_post_increment(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a 1 c"))
+    compile_run_capsys_assert(
+        capsys,
+        "1 a 2 c\na 3 c\n",
+        "{ x = $2++; print x, $0; $2++; print }",
+        [],
+    )
+
+
+def test_field_post_decrement(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a 1 c"))
+    compile_run_capsys_assert(
+        capsys,
+        "1 a 0 c\na -1 c\n",
+        "{ x = $2--; print x, $0; $2--; print }",
+        [],
+    )
+
+
+def test_field_pre_increment(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a 1 c"))
+    compile_run_capsys_assert(
+        capsys,
+        "2 a 2 c\na 3 c 1\n",
+        "{ x = ++$2; print x, $0; ++$2; i = 4; ++$i; print }",
+        [],
+    )
+
+
+def test_field_pre_decrement(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a 1 c"))
+    compile_run_capsys_assert(
+        capsys,
+        "0 a 0 c\na -1 c\n",
+        "{ x = --$2; print x, $0; --$2; print }",
+        [],
+    )
+
+
+def test_field_assigned_in_a_later_source(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a b c"))
+    compile_run_capsys_assert(
+        capsys,
+        "z b x\n",
+        ["-e", "function show() { print $0 }", "-e", '{ $1 = "z"; sub(/c/, "x", $3); show() }'],
+        [],
+    )
+
+
+@pytest.mark.parametrize(
+    "awk,max_field",
+    [
+        ("{ print $1, $3 }", 3),
+        ("/x/ { print $2 }", 2),
+        ("{ print }", 0),
+        ("{ print $1, NF }", 0),
+        ("{ print $NF }", 0),
+        ('{ sub(/a/, "b", $2); print $1 }', 0),
+    ],
+)
+def test_field_projection(awk, max_field):
+    compiler = AwkPyCompiler()
+    python_source = compiler.compile(awk)
+    assert compiler.field_projection() == max_field
+    assert ("self._max_field =" in python_source) == (max_field > 0)
+
+
+def test_field_projection_run(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "-- go\n",
+        "$5 { print $2, $4 }",
+        [full_file_name("lines.txt")],
+    )
+
+
+@pytest.mark.parametrize(
+    "separator,value,line",
+    [
+        ("FS", " ", "a b c d"),
+        ("FPAT", "[a-z]+", "a b c d"),
+        ("FIELDWIDTHS", "1 1 1 1", "abcd"),
+        ("awkpy__csv", 1, "a,b,c,d"),
+    ],
+)
+def test_field_projection_splitters(separator, value, line):
+    """only the fields the program can see are kept, whether or not the
+    splitter stops splitting after them"""
+    runtime = AwkpyRuntimeWrapper()
+    setattr(runtime, separator, value)
+    runtime._max_field = 2
+    runtime._set_dollar_fields(line)
+    assert_equal(["a", "b"], runtime._record.split())
+
+
+def test_FS_change_applies_to_next_record(capsys):
+    compile_run_capsys_assert(
+        capsys,
+        "Line.1\nLine\n",
+        'NR==1 { FS="." ; print $1 } NR==2 { print $1 }',
+        [full_file_name("lines.txt")],
+    )
+
+
+@pytest.mark.parametrize(
+    "FS, answer",
+    [
+        (" ", "2 "),
+        ("\\t", "2 "),
+        ("|", "3 d"),
+        (";c", "2 "),
+        ("[;|]+", "3 d"),
+        ("[^a-z]", "5 c"),
+        ("", "8 b"),
+    ],
+)
+def test_FS_classes(capsys, monkeypatch, FS, answer):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a\tb;c||d\n\n"))
+    compile_run_capsys_assert(
+        capsys,
+        answer + "\n0 \n",
+        f'BEGIN {{ FS="{FS}" }} {{ print NF, $3 }}',
+        [],
+    )
+
+
+def test_FIELDWIDTHS(capsys, monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("AB123  xyz\nCD45\nEF 6 7\n"))
+    compile_run_capsys_assert(
+        capsys,
+        "3 AB 123 xyz\n2 CD 45 \n3 EF 6 7\n",
+        'BEGIN { FIELDWIDTHS = "2 3 2:*" } { print NF, $1, $2, $3 } NR==2 { FS=" " }',
+        [],
+    )
+
+
+def test_FPAT(capsys, monkeypatch):
+    monkeypatch.setattr(
+        "sys.stdin", io.StringIO('Robbins,"1234 Pretty St, NE",USA\na,,b\n,x,\n')
+    )
+    compile_run_capsys_assert(
+        capsys,
+        '3 "1234 Pretty St, NE" USA\n3  b\n3 x \n',
+        """BEGIN { FPAT = "(\\"[^\\"]+\\")|([^,]*)" } { print NF, $2, $3 }""",
+        [],
+    )
+
+
+def test_FPAT_longest_alternative(capsys, monkeypatch):
+    """gawk takes the longest alternative, not the first that matches"""
+    monkeypatch.setattr(
+        "sys.stdin", io.StringIO('Robbins,"1234 Pretty St, NE",USA\nab,xxx,c\n')
+    )
+    compile_run_capsys_assert(
+        capsys,
+        '3 "1234 Pretty St, NE" USA\n3 xxx c\n1 ab,xxx ,c\n',
+        """BEGIN { FPAT = "([^,]*)|(\\"[^\\"]+\\")" } { print NF, $2, $3 }
+        NR == 2 { n = patsplit($0, a, /(a)|(ab,x+)/, s); print n, a[1], s[1] }""",
+        [],
+    )
+
+
 def test_regex():
     compile_run_answer_assert(
         1,
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+""" AWK - Python translator tests
+    exercise the numeric string (strnum) types """
+#
+# Copyright (C) 2022 Julia Ingleby Clement
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from awkpy_runtime import AwkBytesNum, AwkEmptyVar, AwkStrNum
+
+
+@pytest.mark.parametrize(
+    "text,number,numeric",
+    [
+        ("12", 12, True),
+        (" -3.5 ", -3.5, True),
+        ("1e3", 1000.0, True),
+        (".5", 0.5, True),
+        ("12abc", 12, False),
+        ("abc", 0, False),
+        ("", 0, False),
+        ("1_000", 1, False),
+    ],
+)
+def test_strnum_number(text, number, numeric):
+    value = AwkStrNum(text)
+    assert value.number() == number
+    assert type(value.number()) is type(number)
+    assert value.looks_numeric() == numeric
+    assert str(value) == text and type(str(value)) is str
+
+
+def test_strnum_arithmetic():
+    a = AwkStrNum("7")
+    assert a + 1 == 8
+    assert 1 + a == 8
+    assert a - AwkStrNum("2.5") == 4.5
+    assert a * 2 == 14
+    assert 3 * a == 21
+    assert a % 4 == 3
+    assert -a == -7
+    assert AwkEmptyVar() + a == 7
+    assert AwkStrNum("x") + 1 == 1
+
+
+def test_strnum_number_cached():
+    a = AwkStrNum("42")
+    a.number()
+    a._number = 43  # (not parsed again)
+    assert a + 0 == 43
+
+
+def test_strnum_compare():
+    assert AwkStrNum("10") > AwkStrNum("9")
+    assert AwkStrNum("10") > 9
+    assert 9 < AwkStrNum("10")
+    assert AwkStrNum("1.0") == 1
+    assert AwkStrNum("10") < "9"  # a string constant, compared as text
+    assert AwkStrNum("abc") > AwkStrNum("10")
+    assert AwkStrNum("0") == AwkEmptyVar()
+    assert AwkEmptyVar() == AwkStrNum("0")
+    assert AwkStrNum("x") != AwkEmptyVar()
+
+
+def test_strnum_bool():
+    assert not AwkStrNum("0.0")
+    assert AwkStrNum("0x")
+    assert not AwkStrNum("")
+
+
+def test_strnum_dict_key():
+    a = {"5": 1}
+    assert a[AwkStrNum("5")] == 1
+
+
+def test_bytesnum():
+    a = AwkBytesNum(b" 2.5")
+    assert a * 2 == 5.0
+    assert a < AwkBytesNum(b"10")
+    assert AwkBytesNum(b"9") > b"10"
+    assert bytes(a) == b" 2.5"